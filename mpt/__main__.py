@@ -1,18 +1,23 @@
 import argparse
+import functools
+import logging
 import os
+import stat
 import sys
 
 from mpt import __version__
 from .defaults import *
-from .filemanager import FileManager
 from .hashing import algorithms_supported
-from .staging import stage_files
 
+log = logging.getLogger("mpt")
 
-def main(args=None):
-    if args is None:
-        args = sys.argv[1:]
 
+@functools.lru_cache(maxsize=None)
+def _build_parser():
+    """
+    Build the command line argument parser. The parser is built once and reused by subsequent calls.
+    :return: the ArgumentParser
+    """
     # Process CLI arguments
     ap = argparse.ArgumentParser(prog="mpt",
                                  description="Minimum Preservation Tool: file staging and checksum validation "
@@ -25,7 +30,7 @@ def main(args=None):
     create_parser.add_argument("-a", "--algorithm", dest="algorithm",
                                choices=algorithms_supported,
                                default=default_algorithm,
-                               help="the checksum algorithm to use [default: {0}]".format(default_algorithm))
+                               help="the checksum algorithm to use [default: %(default)s]")
     create_parser.add_argument("--formats", dest="formats", nargs="+", help="list of file extensions to include (only)")
     create_parser.add_argument("-m", dest="manifest", help="the manifest to create [default: None]")
     create_parser.add_argument("-r", "--recursive", dest="recursive", action="store_true",
@@ -38,7 +43,7 @@ def main(args=None):
     validate_m_parser.add_argument("dir", help="Directory of files to process")
     validate_m_parser.add_argument("-a", "--algorithm", dest="algorithm", choices=algorithms_supported,
                                    default=default_algorithm,
-                                   help="the checksum algorithm to use [default: {0}]".format(default_algorithm))
+                                   help="the checksum algorithm to use [default: %(default)s]")
     validate_m_parser.add_argument("-m", required=True, dest="manifest", help="the manifest to validate")
 
     # Args for validating checksum tree
@@ -75,7 +80,7 @@ def main(args=None):
     stage_parser.add_argument("dir", help="Directory of files to process")
     stage_parser.add_argument("-a", "--algorithm", dest="algorithm",
                               choices=algorithms_supported, default=default_algorithm,
-                              help="the checksum algorithm to use [default: {0}]".format(default_algorithm))
+                              help="the checksum algorithm to use [default: %(default)s]")
     stage_parser.add_argument("-t", "--trees", dest="trees", nargs="+", default=[],
                               help="list of directories in which to create 'checksum tree' mirroring original data "
                                    "structure. Should match the number of destination directories in number, or be "
@@ -85,9 +90,11 @@ def main(args=None):
                                    "directories in number, or be omitted ")
     stage_parser.add_argument("--no-confirm", dest="no_confirm", action="store_true",
                               help="run without requesting confirmation")
-    stage_parser.add_argument("--max-failures", dest="max_failures", type=int, default=None,
+    stage_parser.add_argument("--max-failures", dest="max_failures", type=int, default=max_failures,
                               help="maximum number of consecutive write failures allowed "
-                                   "[default: {0}]".format(max_failures))
+                                   "[default: %(default)s]")
+    stage_parser.add_argument("--no-verify", dest="verify_writes", action="store_false",
+                              help="don't read back each staged copy to check it against the source checksum")
     stage_parser.add_argument("--keep-staging-folders", dest="keep_empty_folders", action="store_true",
                               help="keep empty folders in staging directory after completion")
     stage_parser.add_argument("-d", "--destinations", required=True, dest="targets", nargs="+", metavar="DESTINATIONS",
@@ -98,58 +105,90 @@ def main(args=None):
     ap.add_argument("-v", "--version", action="version", version='%(prog)s v' + __version__,
                     help="display program version")
     ap.add_argument("-p", "--num-processes", dest="processes", default=default_processes, type=int,
-                    help="number of concurrent processes to run [default: {0}]".format(default_processes))
+                    help="number of concurrent processes to run [default: %(default)s]")
     ap.add_argument("-e", "--email-results", dest="email", metavar="ADDRESS", nargs="+",
                     help="email recipients for results [default: none]")
     ap.add_argument("-o", "--output", dest="output", default=base_output_dir,
-                    help="directory in which to create reports [default: {0}]".format(base_output_dir))
-    ap.add_argument("--no-count", dest="count_files", action="store_false", help="don't count files before processing")
+                    help="directory in which to create reports [default: %(default)s]")
+    ap.add_argument("--no-count", dest="count_files", action="store_false", help="don't count the files to be processed")
     ap.add_argument("--absolute-path", dest="abspath", action="store_true", help="use absolute path in reports")
     ap.add_argument("--cache-size", dest="cache_size", type=int, help="number of results to cache before writing to "
                                                                       "disk")
+    ap.add_argument("--blocksize", dest="blocksize", type=int,
+                    help="block size in bytes for file reads when hashing [default: {} bytes, rounded up to a whole "
+                         "number of filesystem blocks]".format(default_blocksize))
+    ap.add_argument("--log-level", dest="log_level", default="WARNING",
+                    choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
+                    help="minimum severity of messages to log [default: %(default)s]")
+
+    return ap
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    ap = _build_parser()
+    args = ap.parse_args(args)
+    logging.basicConfig(level=args.log_level, format="%(levelname)s %(name)s: %(message)s")
 
-    args = ap.parse_args()
+    if args.actions is None:
+        ap.print_help()
+        return
 
     if hasattr(args, "dir"):
-        if not os.path.exists(args.dir):
+        # A single stat both confirms the path exists and that it is a directory
+        try:
+            dir_stat = os.stat(args.dir)
+        except OSError:
             print("Specified directory ({0}) does not exist.".format(args.dir))
             ap.print_help()
-            return
+            return 1
+        if not stat.S_ISDIR(dir_stat.st_mode):
+            print("Specified path ({0}) is not a directory.".format(args.dir))
+            ap.print_help()
+            return 1
     try:
         if args.actions == 'stage':
+            from .staging import stage_files
             stage_files(args)
         elif args.actions == 'create':
+            from .filemanager import FileManager
             fm = FileManager(primary_path=args.dir, cs_dir=args.tree, manifest_file=args.manifest,
                              algorithm=args.algorithm, recursive=args.recursive, count_files=args.count_files,
                              num_procs=args.processes, email=args.email, formats=args.formats,
-                             output_dir=args.output, absolute_path=args.abspath, cache_size=args.cache_size)
+                             output_dir=args.output, absolute_path=args.abspath, cache_size=args.cache_size,
+                             blocksize=args.blocksize)
             fm.create_checksums()
         elif args.actions == 'validate_manifest':
+            from .filemanager import FileManager
             fm = FileManager(primary_path=args.dir, manifest_file=args.manifest,
                              algorithm=args.algorithm, num_procs=args.processes, count_files=args.count_files,
                              email=args.email, output_dir=args.output, absolute_path=args.abspath,
-                             cache_size=args.cache_size)
+                             cache_size=args.cache_size, blocksize=args.blocksize)
             fm.validate_manifest()
         elif args.actions == 'validate_tree':
+            from .filemanager import FileManager
             fm = FileManager(primary_path=args.dir, cs_dir=args.tree, recursive=args.recursive,
                              num_procs=args.processes, count_files=args.count_files, email=args.email, output_dir=args.output,
-                             absolute_path=args.abspath, cache_size=args.cache_size)
+                             absolute_path=args.abspath, cache_size=args.cache_size, blocksize=args.blocksize)
             fm.validate_tree()
         elif args.actions == "compare_trees":
+            from .filemanager import FileManager
             fm = FileManager(primary_path=args.dir, cs_dir=args.dir, num_procs=args.processes, count_files=args.count_files,
                              email=args.email, output_dir=args.output, other_paths=args.other_paths, recursive=True,
                              absolute_path=args.abspath, cache_size=args.cache_size)
             fm.compare_trees()
         elif args.actions == "compare_manifests":
+            from .filemanager import FileManager
             fm = FileManager(primary_path=args.manifest, num_procs=args.processes, count_files=args.count_files,
                              email=args.email, output_dir=args.output, other_paths=args.other_paths,
                              absolute_path=args.abspath, cache_size=args.cache_size)
             fm.compare_manifests()
-    except AttributeError as e:
-        print(str(e))
-        ap.print_help()
-        return
+    except Exception:
+        log.exception("MPT %s failed", args.actions)
+        return 1
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
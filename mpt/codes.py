@@ -1,7 +1,15 @@
 from enum import Enum
 
 
-class Action(Enum):
+class _Code(Enum):
+    """
+    Base class for MPT's enumerations. Members are singletons compared by identity, so the C-level object hash can
+    replace Enum's Python-level __hash__, which makes the dictionary lookups used to count results much cheaper.
+    """
+    __hash__ = object.__hash__
+
+
+class Action(_Code):
     CREATE = "Checksum creation"
     VALIDATE_MANIFEST = "Manifest validation"
     VALIDATE_TREE = "Checksum tree validation"
@@ -10,7 +18,7 @@ class Action(Enum):
     COMPARE_MANIFESTS = "Manifest comparison"
 
 
-class StagingStatus(Enum):
+class StagingStatus(_Code):
     READY = "Ready for staging"
     STAGED = "Staged"
     DUPLICATE_FILE = "Duplicate data file"
@@ -23,7 +31,7 @@ class StagingStatus(Enum):
     UNSTAGED = "Unstaged"
 
 
-class Result(Enum):
+class Result(_Code):
     pass
 
 
@@ -48,7 +56,7 @@ class ValidationResult(Result):
     OSERROR = "OS Error: cannot open file"
 
 
-ExceptionsResults = [ComparisonResult.UNMATCHED, ComparisonResult.MISSING, ComparisonResult.OSERROR,
-                     CreationResult.ADDED, CreationResult.FAILED,
-                     ValidationResult.INVALID, ValidationResult.MISSING, ValidationResult.ADDITIONAL,
-                     ValidationResult.OSERROR]
+ExceptionsResults = frozenset({ComparisonResult.UNMATCHED, ComparisonResult.MISSING, ComparisonResult.OSERROR,
+                               CreationResult.ADDED, CreationResult.FAILED,
+                               ValidationResult.INVALID, ValidationResult.MISSING, ValidationResult.ADDITIONAL,
+                               ValidationResult.OSERROR})
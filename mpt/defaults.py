@@ -1,11 +1,31 @@
+import os
 from os.path import expanduser, join
 
 default_algorithm = "sha256"
-default_blocksize = 1024 * 2048
+default_blocksize = 1024 * 4096
+read_ahead_depth = 4
 default_cachesize = 1000
-default_processes = 2
+# Upper limits on the number of tasks handed to a worker at once. Hashing tasks are kept in small batches so that
+# large files stay spread across the workers; metadata checks are cheap enough that pickling dominates unless batched
+hash_chunksize = 8
+metadata_chunksize = 256
+# Minimum number of seconds between progress bar redraws
+progress_interval = 0.25
+# Each worker process overlaps its own reads and hashing, so half the logical CPUs is enough to keep them busy
+default_processes = max(2, (os.cpu_count() or 2) // 2)
+# Hashing workers are replaced after handling this many batches of tasks, so that memory they have built up is returned
+# to the OS rather than held for the whole run
+hash_worker_max_tasks = 256
 base_output_dir = join(join(expanduser("~"), "mpt"))
 mail_size_threshold = 10000000
 max_failures = 10
 fallback_to_insecure_smtp = False
 email_only_exceptions = True
+use_o_direct = False
+# Hash and stage files larger than one block through a memory map instead of reads. This avoids copying data out of the
+# page cache, but a file truncated while it is being read then kills the worker process with SIGBUS rather than causing
+# a short read, so it is only suitable where files won't change during a run
+use_mmap = False
+# Staged copies of files at least this size are written through to storage and dropped from the page cache once
+# copied, so that large files written once don't push out cached data which is still in use
+uncached_staging_threshold = 256 * 1024 * 1024
@@ -1,9 +1,15 @@
+import atexit
+import functools
+import io
+import logging
 import os
+import shutil
 import smtplib
 import ssl
 import tempfile
 import zipfile
 from email import encoders
+from email.generator import BytesGenerator
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -11,72 +17,224 @@ from typing import List
 
 from .defaults import fallback_to_insecure_smtp, mail_size_threshold
 
+log = logging.getLogger(__name__)
 
-def send_email(subject: str, recipients: List, message: str,
-               attachments: List = None, zip_files: bool = False):
-    """ Send an e-mail to a recipient by connecting to an SMTP server
+
+@functools.lru_cache(maxsize=None)
+def _tls_context():
+    """
+    Get the TLS context for SMTP connections, built on first use so that the system certificate store is only loaded
+    when an e-mail is actually sent, and then only once
+    :return: the SSL context
+    """
+    return ssl.create_default_context()
+
+
+def _attachment_part(file, maintype: str, subtype: str, filename: str):
+    """ Create a base64-encoded MIME attachment from the contents of a file
+    :param file: a file object opened in binary mode
+    :param maintype: the MIME main type of the attachment
+    :param subtype: the MIME subtype of the attachment
+    :param filename: the file name presented to the recipient
+    :return: the MIMEBase part
+    """
+    part = MIMEBase(maintype, subtype)
+    part.set_payload(file.read())
+    encoders.encode_base64(part)
+    part.add_header('Content-Disposition', 'attachment; filename="{}"'.format(filename))
+    return part
+
+
+def _build_message(subject: str, sender: str, recipients: List, message: str,
+                   attachments: List = None, zip_files: bool = False):
+    """ Build a MIME message ready for sending
     :param subject: the e-mail subject
+    :param sender: the sender address
     :param recipients: a list of e-mail addresses
     :param message: the text of the message
     :param attachments: a list of file paths to attach to the e-mail
     :param zip_files: boolean value indicating whether the attachments should be compressed into a ZIP archive
+    :return: the MIMEMultipart message
     """
-
-    mail_server = os.environ['MAIL_SERVER']
-    mail_server_port = os.environ['MAIL_SERVER_PORT']
-    mail_address = os.environ['MAIL_SENDER_ADDRESS']
-
     mail_msg = MIMEMultipart()
     mail_msg['Subject'] = subject
-    mail_msg['From'] = mail_address
+    mail_msg['From'] = sender
     mail_msg['BCC'] = ','.join(recipients)
     mail_msg.attach(MIMEText(message))
     if zip_files:
-        with tempfile.TemporaryFile(prefix="reports", suffix="zip") as zf:
+        # Small archives stay in memory, larger ones spill to disk
+        with tempfile.SpooledTemporaryFile(max_size=mail_size_threshold, prefix="reports", suffix="zip") as zf:
             zip = zipfile.ZipFile(zf, 'w', zipfile.ZIP_DEFLATED)
             for path in attachments:
-                zip.write(path, arcname=os.path.basename(path))
+                # Keeps the report's modification time, and its size tells ZipFile whether ZIP64 extensions are needed
+                zinfo = zipfile.ZipInfo.from_file(path, os.path.basename(path))
+                zinfo.compress_type = zipfile.ZIP_DEFLATED
+                # Stream each report into the archive in 1 MiB chunks (ZipFile.write copies in 8 KiB chunks)
+                with open(path, 'rb') as src, zip.open(zinfo, 'w') as dst:
+                    shutil.copyfileobj(src, dst, length=1024 * 1024)
             zip.close()
             size = zf.tell()
             if size < mail_size_threshold:
                 zf.seek(0)
-                part = MIMEBase("application", "zip")
-                part.set_payload(zf.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition',
-                                'attachment; filename="reports.zip"')
-                mail_msg.attach(part)
+                mail_msg.attach(_attachment_part(zf, "application", "zip", "reports.zip"))
+            else:
+                log.warning("Reports not attached to e-mail: compressed size of %d bytes exceeds the limit of %d bytes",
+                            size, mail_size_threshold)
     else:
         if attachments is not None:
             for path in attachments:
-                part = MIMEBase("application", "octet-stream")
                 with open(path, 'rb') as file:
-                    part.set_payload(file.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition',
-                                'attachment; filename="{}"'.format(os.path.basename(path)))
-                mail_msg.attach(part)
+                    mail_msg.attach(_attachment_part(file, "application", "octet-stream", os.path.basename(path)))
+    return mail_msg
 
-    server = smtplib.SMTP(mail_server, mail_server_port)
-    try:
-        server.ehlo()
-        if mail_server_port == '587':
-            context = ssl.SSLContext(ssl.PROTOCOL_TLS)
-            server.starttls(context=context)
-            server.ehlo()
-        server.sendmail(mail_address, recipients, mail_msg.as_string())
-    except ssl.SSLError as ssl_e:
-        print('SSL error: ' + str(ssl_e))
-        if fallback_to_insecure_smtp:
-            print("Falling back to insecure SMTP")
-            server = smtplib.SMTP(mail_server, 25)
-            server.ehlo()
-            server.sendmail(mail_address, recipients, mail_msg.as_string())
-            pass
-    except Exception as e:
-        print("Cannot send email, details: " + str(e))
-    finally:
+
+class Mailer:
+    """
+    An SMTP connection which can be reused to send several e-mails, avoiding a new connection and TLS handshake for
+    each one. Intended for use as a context manager.
+    """
+    mail_server = None
+    mail_server_port = None
+    mail_address = None
+    server = None
+
+    def __init__(self):
+        """
+        Initialisation function for the Mailer class. Server details are read from the MAIL_SERVER, MAIL_SERVER_PORT
+        and MAIL_SENDER_ADDRESS environment variables.
+        """
+        self.mail_server = os.environ['MAIL_SERVER']
+        self.mail_server_port = os.environ['MAIL_SERVER_PORT']
+        self.mail_address = os.environ['MAIL_SENDER_ADDRESS']
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """
+        Connect to the SMTP server, using TLS (port 465) or STARTTLS (port 587) where the server port requires it
+        """
+        try:
+            self._connect()
+        except BaseException:
+            # Don't leave a connection open which failed part of the way through being set up
+            self.close()
+            raise
+
+    def _connect(self):
+        """
+        Make the connection to the SMTP server, falling back to insecure SMTP after an SSL error if configured to
+        """
+        if self.mail_server_port == '465':
+            # Implicit TLS, which saves the STARTTLS round trip
+            try:
+                self.server = smtplib.SMTP_SSL(self.mail_server, self.mail_server_port, context=_tls_context())
+                self.server.ehlo()
+            except ssl.SSLError as ssl_e:
+                self._fall_back(ssl_e)
+            return
+        self.server = smtplib.SMTP(self.mail_server, self.mail_server_port)
+        self.server.ehlo()
+        if self.mail_server_port == '587':
+            try:
+                self.server.starttls(context=_tls_context())
+                self.server.ehlo()
+            except ssl.SSLError as ssl_e:
+                self._fall_back(ssl_e)
+
+    def _fall_back(self, ssl_e: ssl.SSLError):
+        """
+        Replace the current connection with an insecure one if configured to do so, otherwise re-raise the SSL error
+        :param ssl_e: the SSL error which occurred
+        """
+        log.warning("SSL error: %s", ssl_e)
+        self.close()
+        if not fallback_to_insecure_smtp:
+            raise ssl_e
+        log.warning("Falling back to insecure SMTP")
+        self.server = smtplib.SMTP(self.mail_server, 25)
+        self.server.ehlo()
+
+    def send(self, subject: str, recipients: List, message: str,
+             attachments: List = None, zip_files: bool = False):
+        """ Send an e-mail over the connection, connecting first if it is not open
+        :param subject: the e-mail subject
+        :param recipients: a list of e-mail addresses
+        :param message: the text of the message
+        :param attachments: a list of file paths to attach to the e-mail
+        :param zip_files: boolean value indicating whether the attachments should be compressed into a ZIP archive
+        """
+        mail_msg = _build_message(subject=subject, sender=self.mail_address, recipients=recipients,
+                                  message=message, attachments=attachments, zip_files=zip_files)
+        # Render once, straight to bytes with SMTP line endings, so that neither smtplib nor a fallback resend has to
+        # encode the message again
+        buffer = io.BytesIO()
+        BytesGenerator(buffer, mangle_from_=False, maxheaderlen=0,
+                       policy=mail_msg.policy.clone(linesep="\r\n")).flatten(mail_msg)
+        rendered = buffer.getvalue()
+        if self.server is None:
+            self.open()
         try:
-            server.quit()
+            self.server.sendmail(self.mail_address, recipients, rendered)
         except smtplib.SMTPServerDisconnected:
-            pass
+            # A connection kept open between e-mails may have been dropped by the server in the meantime
+            self.close()
+            self.open()
+            self.server.sendmail(self.mail_address, recipients, rendered)
+        except ssl.SSLError as ssl_e:
+            self._fall_back(ssl_e)
+            self.server.sendmail(self.mail_address, recipients, rendered)
+
+    def close(self):
+        """
+        Close the connection to the SMTP server
+        """
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                # The server couldn't be told, so the socket is closed without it
+                self.server.close()
+            self.server = None
+
+
+# The Mailer used by send_email when the caller doesn't give one, kept open for every e-mail this process sends
+_shared_mailer = None
+
+
+def shared_mailer():
+    """
+    Get this process's shared Mailer, creating it on first use. Its connection is opened when the first e-mail is sent
+    through it and closed when the process exits.
+    :return: the Mailer
+    """
+    global _shared_mailer
+    if _shared_mailer is None:
+        _shared_mailer = Mailer()
+        atexit.register(_shared_mailer.close)
+    return _shared_mailer
+
+
+def send_email(subject: str, recipients: List, message: str,
+               attachments: List = None, zip_files: bool = False, mailer: Mailer = None):
+    """ Send an e-mail to a recipient through an SMTP server
+    :param subject: the e-mail subject
+    :param recipients: a list of e-mail addresses
+    :param message: the text of the message
+    :param attachments: a list of file paths to attach to the e-mail
+    :param zip_files: boolean value indicating whether the attachments should be compressed into a ZIP archive
+    :param mailer: the Mailer to send the e-mail through [default: the one shared by this process]
+    """
+    try:
+        if mailer is None:
+            mailer = shared_mailer()
+        mailer.send(subject=subject, recipients=recipients, message=message, attachments=attachments,
+                    zip_files=zip_files)
+    except ssl.SSLError:
+        pass
+    except Exception as e:
+        log.error("Cannot send email, details: %s", e)
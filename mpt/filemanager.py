@@ -1,3 +1,4 @@
+import functools
 import mmap
 import multiprocessing
 import os
@@ -8,11 +9,25 @@ from .codes import (Action, ComparisonResult, CreationResult,
                     ExceptionsResults, ValidationResult)
 from .defaults import *
 from .email import send_email
-from .hashing import hash_file, algorithms_supported
+from .hashing import hash_file, algorithms_supported, threads_per_process
+from .manifests import manifest_writer
 from .paths import fix_path
 from .results import ReportHandler
 
 
+def suffix_tuple(formats):
+    """
+    Prepare a list of file extensions for matching with str.endswith
+    :param formats: a list of file extensions, or None
+    :return: a tuple of the distinct extensions in their original order, or None if formats is None
+    """
+    if formats is None:
+        return None
+    # str.endswith checks a tuple of suffixes in C, which beats set or trie lookups made from Python for any
+    # realistic number of formats, so the only saving to be had is not checking the same suffix twice
+    return tuple(dict.fromkeys(formats))
+
+
 def scan_tree(path, recursive=False, formats: list = None):
     """
     A generator to return all files within a directory.
@@ -22,19 +37,29 @@ def scan_tree(path, recursive=False, formats: list = None):
         extensions
     :return: an iterable sequence of files found by the scan
     """
-    for entry in os.scandir(path):
+    # Walk with an explicit stack of directories rather than recursive generators, so that deep trees don't build up
+    # a chain of suspended generator frames for every file yielded
+    suffixes = suffix_tuple(formats)
+    directories = [path]
+    while directories:
+        next_dir = directories.pop()
         try:
-            if entry.is_dir(follow_symlinks=False) and recursive:
-                yield from scan_tree(entry.path, recursive, formats)
-            else:
-                if entry.is_file():
-                    if formats is None:
-                        yield entry.path
-                    else:
-                        if entry.path.endswith(tuple(formats)):
-                            yield entry.path
+            entries = os.scandir(next_dir)
         except PermissionError:
-            pass
+            if next_dir is path:
+                raise
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            directories.append(entry.path)
+                    elif entry.is_file():
+                        if suffixes is None or entry.name.endswith(suffixes):
+                            yield entry.path
+                except PermissionError:
+                    pass
 
 
 def walk_tree(path, recursive=False, formats: list = None):
@@ -47,24 +72,18 @@ def walk_tree(path, recursive=False, formats: list = None):
         extensions
     :return: an iterable sequence of files found by the walk
     """
+    suffixes = suffix_tuple(formats)
     if recursive:
         for root, dirs, files in os.walk(path):
             for file in files:
-                full_path = os.path.join(root, file)
-                if formats is None:
-                    yield full_path
-                else:
-                    if full_path.endswith(tuple(formats)):
-                        yield full_path
+                if suffixes is None or file.endswith(suffixes):
+                    yield os.path.join(root, file)
     else:
         for file in os.listdir(path):
-            full_path = os.path.join(path, file)
-            if os.path.isfile(full_path):
-                if formats is None:
+            if suffixes is None or file.endswith(suffixes):
+                full_path = os.path.join(path, file)
+                if os.path.isfile(full_path):
                     yield full_path
-                else:
-                    if full_path.endswith(tuple(formats)):
-                        yield full_path
 
 
 def count_lines(file_path: str):
@@ -73,10 +92,16 @@ def count_lines(file_path: str):
     :param file_path: path to the file
     :return: the number of lines
     """
-    with open(file_path, 'r', errors='ignore') as f:
-        for i, l in enumerate(f):
-            pass
-    return i + 1
+    count = 0
+    last_block = b""
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(default_blocksize), b""):
+            count += block.count(b"\n")
+            last_block = block
+    # Include a final line with no trailing newline
+    if last_block and not last_block.endswith(b"\n"):
+        count += 1
+    return count
 
 
 def iterate_manifest(file_path: str):
@@ -86,11 +111,174 @@ def iterate_manifest(file_path: str):
     :return: an iterable sequence of list items, each containing the components [checksum, file path] of a
         manifest record
     """
-    with open(file_path, 'r', encoding='utf8', errors='surrogateescape') as in_file:
-        for line in in_file:
-            line_s = line.rstrip('\r\n').split(' ', 1)
-            if len(line_s) > 1:
-                yield line_s
+    with open(file_path, 'rb') as in_file:
+        if os.fstat(in_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as manifest_map:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                manifest_map.madvise(mmap.MADV_SEQUENTIAL)
+            start = 0
+            end = len(manifest_map)
+            while start < end:
+                stop = manifest_map.find(b"\n", start)
+                if stop == -1:
+                    stop = end
+                line_s = manifest_map[start:stop].rstrip(b"\r").split(b" ", 1)
+                start = stop + 1
+                if len(line_s) > 1:
+                    yield [line_s[0].decode("utf8", "surrogateescape"), line_s[1].decode("utf8", "surrogateescape")]
+
+
+def progress_bar(iterable, desc: str, total: int = None):
+    """
+    Wrap an iterable in a progress bar which redraws at a limited rate, so that fast passes spend their time on the
+    work rather than on terminal output
+    :param iterable: the iterable to wrap
+    :param desc: the description shown with the progress bar
+    :param total: the expected number of items, or None if not known
+    :return: the wrapped iterable
+    """
+    # Smoothing keeps the ETA steady when task durations vary widely; with no total, the count is shown as 1.2k etc.
+    return tqdm(iterable, desc=desc, total=total, mininterval=progress_interval, smoothing=0.1,
+                unit_scale=total is None)
+
+
+def count_into(iterable, progress):
+    """
+    Pass on the items of an iterable, adding each one to a progress bar's total as it is taken. A walk feeding a pool
+    is then counted as it proceeds, with neither a separate counting pass nor a list of every path found.
+    :param iterable: the items to count
+    :param progress: the progress bar whose total is increased
+    :return: an iterable sequence of the same items
+    """
+    for item in iterable:
+        progress.total += 1
+        yield item
+
+
+def read_checksum(file_path: str):
+    """
+    Read the checksum value from a checksum file. Only the start of the file is needed, so it is read with unbuffered
+    OS calls rather than through a buffered text file object
+    :param file_path: path to the checksum file
+    :return: the checksum
+    """
+    fd = os.open(file_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        data = os.read(fd, 1024)
+        # The checksum is complete once the space separating it from the file name has been read
+        while b" " not in data:
+            block = os.read(fd, 1024)
+            if not block:
+                break
+            data += block
+    finally:
+        os.close(fd)
+    return data.split(b" ", 1)[0].rstrip(b"\r\n").decode("utf-8", "surrogateescape")
+
+
+def relative_path(file_path: str, root: str):
+    """
+    Get the path of a file relative to a root directory. Paths found by scanning the root already begin with it, so
+    these are sliced rather than resolved component by component with os.path.relpath
+    :param file_path: path to the file
+    :param root: the root directory
+    :return: the relative path
+    """
+    if not root.endswith(os.sep):
+        root += os.sep
+    if file_path.startswith(root):
+        return file_path[len(root):]
+    return os.path.relpath(file_path, root)
+
+
+def checksum_record(checksum: str, path: str):
+    """
+    Format a single record for a checksum file or manifest
+    :param checksum: the hex digest value of the file
+    :param path: the path of the file relative to the checksum file or manifest root
+    :return: the record, including its trailing newline
+    """
+    return f"{checksum} *{os.sep}{path}\n"
+
+
+def create_checksum_file(file_path: str):
+    """
+    Create a new checksum file and open it for writing, creating its directory first if necessary
+    :param file_path: path to the checksum file
+    :return: the open file object
+    :raises FileExistsError: if the checksum file already exists
+    """
+    try:
+        return open(file_path, 'x', encoding='utf-8', errors="surrogateescape")
+    except FileNotFoundError:
+        try:
+            os.makedirs(os.path.dirname(file_path))
+        except FileExistsError:
+            pass
+    return open(file_path, 'x', encoding='utf-8', errors="surrogateescape")
+
+
+# The FileManager used by a worker process, set once per worker by the pool initializer
+_worker_file_manager = None
+# Indexes of manifest files keyed by manifest path. Built by the main process for the action being carried out and
+# handed to each worker by the pool initializer
+_manifest_indexes = {}
+
+
+def _init_worker(file_manager, manifest_indexes: dict = None):
+    """
+    Pool initializer: keep a copy of the FileManager in the worker process, so that it is transferred once per worker
+    rather than once per task
+    :param file_manager: the FileManager carrying out the current action
+    :param manifest_indexes: indexes of manifest files already built by the main process, keyed by manifest path
+    """
+    global _worker_file_manager, _manifest_indexes
+    _worker_file_manager = file_manager
+    _manifest_indexes = {} if manifest_indexes is None else manifest_indexes
+
+
+def _read_manifest_index(file_path: str):
+    """
+    Read a manifest file into an index of its records
+    :param file_path: path to the manifest file
+    :return: a dictionary mapping each file path listed in the manifest (in the form *<sep><relative path>) to its
+        checksum
+    """
+    return {path: checksum for checksum, path in iterate_manifest(file_path)}
+
+
+def _manifest_index(file_path: str):
+    """
+    Get the index of the records in a manifest file, reading the manifest only if no index has been built for it yet
+    :param file_path: path to the manifest file
+    :return: a dictionary mapping each file path listed in the manifest (in the form *<sep><relative path>) to its
+        checksum
+    """
+    manifest_index = _manifest_indexes.get(file_path)
+    if manifest_index is None:
+        manifest_index = _read_manifest_index(file_path)
+        _manifest_indexes[file_path] = manifest_index
+    return manifest_index
+
+
+def _run_worker_task(method_name: str, item):
+    """
+    Call a method of the worker's FileManager for a single item of work
+    :param method_name: name of the FileManager method to call
+    :param item: the item to process
+    :return: the result of the method call
+    """
+    return getattr(_worker_file_manager, method_name)(item)
+
+
+def _worker_task(method_name: str):
+    """
+    Create a cheaply picklable task which calls a FileManager method inside a worker process
+    :param method_name: name of the FileManager method to call
+    :return: a callable taking a single item of work
+    """
+    return functools.partial(_run_worker_task, method_name)
 
 
 class FileManager:
@@ -106,7 +294,10 @@ class FileManager:
     output_dir = base_output_dir
     algorithm = default_algorithm
     num_procs = default_processes
-    blocksize = default_blocksize
+    # Threads each worker may use to hash a single large file, set from num_procs when initialised
+    hash_threads = 1
+    # None lets the hashing module choose a block size for each file
+    blocksize = None
     cache_size = default_cachesize
     count_files = True
     recursive = True
@@ -127,10 +318,11 @@ class FileManager:
         :param cs_dir: the top-level directory of the "checksum tree" used to hold checksum files
         :param manifest_file: path to the manifest file being used
         :param algorithm: the checksum algorithm to be used
-        :param blocksize: the block size used for I/O operations when calculating checksums
+        :param blocksize: the block size used for I/O operations when calculating checksums [default: chosen for each
+            file from the filesystem's preferred I/O size]
         :param num_procs: the number of concurrent processes to spawn
         :param recursive: true if directories beneath primary_path should be processed recursively
-        :param count_files: true to count files prior to processing (increases startup time)
+        :param count_files: true to count the files to be processed, showing progress against the total
         :param email: list of email addresses to send reports to on completion
         :param formats: list of file extensions to restrict checksum creation to
         :param output_dir: base directory in which report subfolders should be created
@@ -160,12 +352,38 @@ class FileManager:
             self.blocksize = blocksize
         if num_procs is not None:
             self.num_procs = num_procs
+        self.hash_threads = threads_per_process(self.num_procs)
         if cache_size is not None:
             self.cache_size = cache_size
         if self.debug_mode:
             for k, v in self.__dict__.items():
                 print("{}: {}".format(k, v))
 
+    def _create_pool(self, processes: int = None, max_tasks: int = None, manifest_indexes: dict = None):
+        """
+        Create a process pool whose workers each receive a copy of this FileManager when they start
+        :param processes: the number of worker processes, if different from the configured number
+        :param max_tasks: the number of tasks after which each worker is replaced, or None to keep workers for the
+            lifetime of the pool
+        :param manifest_indexes: indexes of manifest files, keyed by manifest path, to hand to every worker
+        :return: the multiprocessing pool
+        """
+        if processes is None:
+            processes = self.num_procs
+        return multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(self, manifest_indexes),
+                                    maxtasksperchild=max_tasks)
+
+    def _chunksize(self, item_count: int, max_chunksize: int):
+        """
+        Choose how many tasks to send to a worker at once, aiming for several batches per worker
+        :param item_count: the number of items to be processed, or None if not known
+        :param max_chunksize: the largest batch size to use
+        :return: the chunk size to pass to the pool
+        """
+        if item_count is None:
+            return max(1, max_chunksize // 4)
+        return max(1, min(max_chunksize, item_count // (self.num_procs * 4)))
+
     def _email_report(self):
         """
         Email the results of checksum operations to the configured recipients
@@ -183,16 +401,15 @@ class FileManager:
                 else:
                     mail_subject = "BL MPT {}: New files detected".format(self.last_action.value)
 
+        # Entry types come from the directory listing itself, so reports are found without a stat for each one
+        with os.scandir(self.report_handler.out_dir) as entries:
+            reports = [e for e in entries if e.name.endswith("csv") and e.is_file()]
         if email_only_exceptions:
-            exceptions = [f.name.lower() for f in ExceptionsResults]
-            attachments = [os.path.join(self.report_handler.out_dir, f) for f in os.listdir(self.report_handler.out_dir)
-                           if (os.path.isfile(os.path.join(self.report_handler.out_dir, f)) and f.endswith("csv")
-                               and os.path.splitext(f)[0] in exceptions)]
-        else:
-            attachments = [os.path.join(self.report_handler.out_dir, f) for f in os.listdir(self.report_handler.out_dir)
-                           if (os.path.isfile(os.path.join(self.report_handler.out_dir, f)) and f.endswith("csv"))]
+            exceptions = {f.name.lower() for f in ExceptionsResults}
+            reports = [e for e in reports if os.path.splitext(e.name)[0] in exceptions]
+        attachments = [e.path for e in reports]
 
-        size = sum(os.path.getsize(f) for f in attachments)
+        size = sum(e.stat().st_size for e in reports)
         zip = size >= mail_size_threshold
         send_email(subject=mail_subject, recipients=self.email, message=mail_body, attachments=attachments,
                    zip_files=zip)
@@ -219,17 +436,29 @@ class FileManager:
         if self.email is not None:
             self._email_report()
 
-    def _check_for_cs_file(self, data_file_path: str):
+    def _note_checksummed_files(self, cs_file_paths, checksummed: set):
+        """
+        Pass through a sequence of checksum file paths, noting the data file which each one belongs to
+        :param cs_file_paths: an iterable sequence of paths to checksum files
+        :param checksummed: a set to which the path of each data file, relative to the checksum tree, is added
+        :return: an iterable sequence of the same checksum file paths
+        """
+        for cs_file_path in cs_file_paths:
+            data_rel_path, ext = os.path.splitext(relative_path(cs_file_path, self.cs_dir))
+            if ext[1:] in algorithms_supported:
+                checksummed.add(data_rel_path)
+            yield cs_file_path
+
+    def _check_for_cs_file(self, data_file_path: str, checksummed: set):
         """
         Checks whether a checksum file exists in a tree for the given data file
         :param data_file_path: path to the data file
+        :param checksummed: the set of data file paths, relative to the checksum tree, which have a checksum file
         :return: a tuple in the form (relative path to data file, validation result) or (None, None) if file exists
         """
-        rel_path = os.path.relpath(data_file_path, self.primary_path)
-        for ext in algorithms_supported:
-            cs_file_path = fix_path(os.path.join(self.cs_dir, rel_path) + '.' + ext)
-            if os.path.exists(cs_file_path):
-                return None, None
+        rel_path = relative_path(data_file_path, self.primary_path)
+        if rel_path in checksummed:
+            return None, None
         return rel_path, ValidationResult.ADDITIONAL
 
     def _check_for_file_in_manifest(self, data_file_path: str):
@@ -239,60 +468,37 @@ class FileManager:
         :return: a tuple in the form (relative path to data file, validation result) or (None, None) if the file is
             listed
         """
-        with open(self.manifest_file, 'r') as manifest:
-            # Make allowance for paths containing using either forward slashes or escaped
-            # backslashes as separators
-            rel_path = os.path.relpath(data_file_path, self.primary_path)
-            paths = [
-                "*{sep}{path}".format(sep=os.sep, path=rel_path),
-                "*{sep}{path}".format(sep="/", path=rel_path.replace("\\","/"))
-            ]
-            manifest_map = mmap.mmap(manifest.fileno(), 0, access=mmap.ACCESS_READ)
-            for next_path in paths:
-                found = manifest_map.find(next_path.encode("utf-8"))
-                if found != -1:
-                    return None, None
-            return rel_path, ValidationResult.ADDITIONAL
-
-    def _check_other_manifests(self, manifest_line: str):
+        manifest_index = _manifest_index(self.manifest_file)
+        # Make allowance for paths containing using either forward slashes or escaped
+        # backslashes as separators
+        rel_path = relative_path(data_file_path, self.primary_path)
+        listed_path = f"*{os.sep}{rel_path}"
+        if listed_path in manifest_index:
+            return None, None
+        # On POSIX the forward slash form is usually identical, so it only needs a second lookup when it differs
+        slash_path = "*/" + rel_path.replace("\\", "/")
+        if slash_path != listed_path and slash_path in manifest_index:
+            return None, None
+        return rel_path, ValidationResult.ADDITIONAL
+
+    def _check_other_manifests(self, manifest_record):
         """
         Compare an entry in a manifest file to the corresponding entry in other manifests
-        :param manifest_line: the text of the manifest entry
+        :param manifest_record: a list in the form [checksum, file path], as read by iterate_manifest
         :return: a Tuple in the form (file path, {results}) where (results) is a dictionary containing
             the status of the checksum data in other trees
         """
-        manifest_maps = {}
+        file_cs, file_path = manifest_record
         results = {}
 
-        for m in self.other_paths:
-            next_file = open(m, 'r')
-            next_map = mmap.mmap(next_file.fileno(), 0, access=mmap.ACCESS_READ)
-            manifest_maps[m] = next_map
-
-        try:
-            file_cs = manifest_line.split()[0]
-            file_path = ' '.join(manifest_line.split()[1:])
-        # Handle blank lines
-        except IndexError:
-            return None, None
-        if len(file_path) == 0:
-            return None, None
-
-        for manifest_path, manifest_map in manifest_maps.items():
-            found = manifest_map.find(file_path.encode("utf-8"))
-            if found == -1:
+        for manifest_path in self.other_paths:
+            manifest_cs = _manifest_index(manifest_path).get(file_path)
+            if manifest_cs is None:
                 results[manifest_path] = ComparisonResult.MISSING
+            elif manifest_cs != file_cs:
+                results[manifest_path] = ComparisonResult.UNMATCHED
             else:
-                s_pos = found - (len(file_cs) + 1)
-                e_pos = s_pos + len(file_cs)
-                manifest_cs = manifest_map[s_pos:e_pos]
-                if manifest_cs.decode("utf-8") != file_cs:
-                    results[manifest_path] = ComparisonResult.UNMATCHED
-                else:
-                    results[manifest_path] = ComparisonResult.MATCHED
-
-        for m in manifest_maps.values():
-            m.close()
+                results[manifest_path] = ComparisonResult.MATCHED
 
         r_val = self._normalise_path(file_path), results
         return r_val
@@ -306,26 +512,22 @@ class FileManager:
             the status of the checksum data in other trees
         """
         results = {}
-        rel_path = os.path.relpath(checksum_file_path, self.primary_path)
-        file_key = "*{sep}{path}".format(sep=os.sep, path=rel_path)
+        rel_path = relative_path(checksum_file_path, self.primary_path)
+        file_key = f"*{os.sep}{rel_path}"
         in_path = fix_path(checksum_file_path)
         try:
-            with open(in_path, "r", encoding="utf-8", errors="surrogateescape") as cs_file:
-                cs_line = cs_file.read().rstrip('\r\n').split(' ')
-                master_cs = cs_line[0]
+            master_cs = read_checksum(in_path)
             for next_tree in self.other_paths:
                 try:
                     other_cs_path = fix_path(os.path.join(next_tree, rel_path))
-                    if os.path.exists(other_cs_path):
-                        with open(other_cs_path, "r", encoding="utf-8", errors="surrogateescape") as cs_file:
-                            cs_line = cs_file.read().rstrip('\r\n').split(' ')
-                            other_cs = cs_line[0]
-                        if master_cs == other_cs:
-                            results[next_tree] = ComparisonResult.MATCHED
-                        else:
-                            results[next_tree] = ComparisonResult.UNMATCHED
+                    # Open the file directly rather than checking for it first, saving a stat per tree
+                    other_cs = read_checksum(other_cs_path)
+                    if master_cs == other_cs:
+                        results[next_tree] = ComparisonResult.MATCHED
                     else:
-                        results[next_tree] = ComparisonResult.MISSING
+                        results[next_tree] = ComparisonResult.UNMATCHED
+                except (FileNotFoundError, NotADirectoryError):
+                    results[next_tree] = ComparisonResult.MISSING
                 except OSError:
                     results[next_tree] = ComparisonResult.OSERROR
                     pass
@@ -344,31 +546,42 @@ class FileManager:
         """
         if algorithm is None:
             algorithm = self.algorithm
-        r_path = os.path.relpath(in_file, self.primary_path)
+        r_path = relative_path(in_file, self.primary_path)
         out_file = fix_path(
             os.path.join(self.cs_dir, r_path) + '.' + algorithm
         )
-        if os.path.exists(out_file):
-            return in_file, CreationResult.SKIPPED, None
-        else:
-            if not os.path.exists(os.path.dirname(out_file)):
-                try:
-                    os.makedirs(os.path.dirname(out_file))
-                except FileExistsError:
-                    pass
+        # An existing checksum file is detected by the exclusive create itself, rather than by a stat beforehand
+        try:
+            try:
+                cs_file = create_checksum_file(out_file)
+            except FileExistsError:
+                # An empty checksum file is left behind when a worker is killed while hashing, so it is written again
+                # rather than counted as done
+                if os.path.getsize(out_file) > 0:
+                    return in_file, CreationResult.SKIPPED, None
+                cs_file = open(out_file, 'w', encoding='utf-8', errors="surrogateescape")
+        except OSError as e:
+            print(str(e))
+            return in_file, CreationResult.FAILED, None
+        try:
+            with cs_file:
+                checksum, size = hash_file(in_file, algorithm=algorithm, blocksize=self.blocksize,
+                                           max_threads=self.hash_threads)
+                cs_file.write(checksum_record(checksum, os.path.basename(in_file)))
+        except BaseException as e:
+            # Don't leave an empty checksum file behind, or the data file would be skipped on the next run. This
+            # includes an interrupted run (e.g. KeyboardInterrupt), which is then allowed to carry on stopping
             try:
-                checksum, size = hash_file(in_file, algorithm=algorithm)
-                with open(out_file, 'w', encoding='utf-8', errors="surrogateescape") as cs_file:
-                    cs_file.write("{cs} *{sep}{path}\n".format(cs=checksum,
-                                                               sep=os.sep,
-                                                               path=os.path.basename(in_file)))
-            except Exception as e:
-                print(str(e))
-                return in_file, CreationResult.FAILED, None
-            if self.manifest_file is not None:
-                with open(self.manifest_file, 'a+', encoding='utf-8') as manifest_file:
-                    manifest_file.write("{cs} *{sep}{path}\n".format(cs=checksum, sep=os.sep, path=r_path))
-            return self._normalise_path(in_file), CreationResult.ADDED, size
+                os.remove(out_file)
+            except OSError:
+                pass
+            if not isinstance(e, Exception):
+                raise
+            print(str(e))
+            return in_file, CreationResult.FAILED, None
+        if self.manifest_file is not None:
+            manifest_writer(self.manifest_file).write(checksum_record(checksum, r_path))
+        return self._normalise_path(in_file), CreationResult.ADDED, size
 
     def _validate_checksum_file(self, checksum_file_path: str, algorithm: str = None):
         """ Use a checksum file within a checksum tree to validate its
@@ -383,28 +596,27 @@ class FileManager:
         fixed_path = fix_path(checksum_file_path)
 
         try:
-            with open(fixed_path, "r", encoding="utf-8", errors="surrogateescape") as cs_file:
-                cs_line = cs_file.read().rstrip('\r\n').split(' ')
-                original_cs = cs_line[0]
+            original_cs = read_checksum(fixed_path)
         except OSError:
             r_val = self._normalise_path(checksum_file_path), ValidationResult.OSERROR
             return r_val
-        cs_rel_path = os.path.relpath(checksum_file_path, self.cs_dir)
+        cs_rel_path = relative_path(checksum_file_path, self.cs_dir)
         data_rel_path = os.path.splitext(cs_rel_path)[0]
         full_path = fix_path(os.path.join(self.primary_path, data_rel_path))
-        file_key = "*{sep}{path}".format(sep=os.sep, path=os.path.join(data_rel_path))
+        file_key = f"*{os.sep}{data_rel_path}"
         size = 0
-        if os.path.exists(full_path):
-            try:
-                current_cs, size = hash_file(full_path, algorithm=algorithm)
-                if current_cs == original_cs:
-                    file_status = ValidationResult.VALID
-                else:
-                    file_status = ValidationResult.INVALID
-            except OSError:
-                file_status = ValidationResult.OSERROR
-        else:
+        # A missing data file is detected when it is opened for hashing, saving a stat per file
+        try:
+            current_cs, size = hash_file(full_path, algorithm=algorithm, blocksize=self.blocksize,
+                                         max_threads=self.hash_threads)
+            if current_cs == original_cs:
+                file_status = ValidationResult.VALID
+            else:
+                file_status = ValidationResult.INVALID
+        except (FileNotFoundError, NotADirectoryError):
             file_status = ValidationResult.MISSING
+        except OSError:
+            file_status = ValidationResult.OSERROR
         r_val = self._normalise_path(file_key), file_status, size
         return r_val
 
@@ -416,18 +628,18 @@ class FileManager:
         original_cs, rel_path = original_checksum_data
         full_path = fix_path(rel_path.replace('*', self.primary_path))
         size = None
-        if os.path.exists(full_path):
-            try:
-                current_cs, size = hash_file(full_path, algorithm=self.algorithm)
-                if current_cs == original_cs:
-                    file_status = ValidationResult.VALID
-                else:
-                    file_status = ValidationResult.INVALID
-            except OSError:
-                file_status = ValidationResult.OSERROR
-                pass
-        else:
+        # A missing data file is detected when it is opened for hashing, saving a stat per file
+        try:
+            current_cs, size = hash_file(full_path, algorithm=self.algorithm, blocksize=self.blocksize,
+                                         max_threads=self.hash_threads)
+            if current_cs == original_cs:
+                file_status = ValidationResult.VALID
+            else:
+                file_status = ValidationResult.INVALID
+        except (FileNotFoundError, NotADirectoryError):
             file_status = ValidationResult.MISSING
+        except OSError:
+            file_status = ValidationResult.OSERROR
         r_val = self._normalise_path(rel_path), file_status, size
         return r_val
 
@@ -436,32 +648,41 @@ class FileManager:
         Compare the contents of a master manifest file to other files
         """
         self.last_action = Action.COMPARE_MANIFESTS
+        # primary_path is always given a trailing separator, which doesn't belong on the manifest file path
+        manifest_path = os.path.normpath(self.primary_path)
         self.report_handler = ReportHandler(action=self.last_action, out_dir=self.output_dir,
                                             summary_data={
-                                                "primary_path": self.primary_path
+                                                "primary_path": manifest_path
                                             })
 
-        pool = multiprocessing.Pool(processes=self.num_procs)
+        # The other manifests are indexed once here and shared with every worker, rather than each worker reading
+        # and indexing all of them for itself
+        manifest_indexes = {path: _read_manifest_index(path) for path in self.other_paths}
+        pool = self._create_pool(manifest_indexes=manifest_indexes)
         if self.count_files:
-            line_count = count_lines(self.primary_path)
+            line_count = count_lines(manifest_path)
         else:
             line_count = None
 
         results_cache = []
 
-        with open(self.primary_path, 'r') as manifest_file:
-            for file_path, status in tqdm(pool.imap_unordered(self._check_other_manifests, manifest_file),
-                                          total=line_count, desc="MPT({}p)/Comparing manifests".format(self.num_procs)):
-                if file_path is not None:
-                    results_cache.append((file_path, status))
-                if len(results_cache) >= self.cache_size:
-                    for next_path, next_status in results_cache:
-                        self.report_handler.assign_comparison_result(file_path=next_path, file_status=next_status)
-                    self.report_handler.write_summary()
-                    results_cache = []
+        # Records are parsed once here, so the workers only have to look them up in the other manifests
+        for file_path, status in progress_bar(
+                pool.imap_unordered(_worker_task("_check_other_manifests"), iterate_manifest(manifest_path),
+                                    self._chunksize(line_count, metadata_chunksize)),
+                total=line_count, desc="MPT({}p)/Comparing manifests".format(self.num_procs)):
+            results_cache.append((file_path, status))
+            if len(results_cache) >= self.cache_size:
+                for next_path, next_status in results_cache:
+                    self.report_handler.assign_comparison_result(file_path=next_path, file_status=next_status)
+                self.report_handler.write_summary()
+                results_cache.clear()
         # Write any records remaining in the cache after all files are processed
         for next_path, next_status in results_cache:
             self.report_handler.assign_comparison_result(file_path=next_path, file_status=next_status)
+        pool.close()
+        pool.join()
+        manifest_indexes.clear()
         self.report_handler.close()
         self._show_results()
 
@@ -476,28 +697,30 @@ class FileManager:
                                                 "primary_path": self.primary_path
                                             })
 
-        pool = multiprocessing.Pool(processes=self.num_procs)
+        pool = self._create_pool()
         files_iterable = scan_tree(path=self.primary_path, recursive=self.recursive)
-
+        progress = progress_bar(None, total=0 if self.count_files else None,
+                                desc="MPT({}p)/Comparing checksums".format(self.num_procs))
         if self.count_files:
-            file_count = sum([1 for x in files_iterable])
-            files_iterable = scan_tree(path=self.primary_path, recursive=self.recursive)
-        else:
-            file_count = None
+            files_iterable = count_into(files_iterable, progress)
 
         results_cache = []
 
-        for file_path, status in tqdm(pool.imap_unordered(self._compare_checksum_file_to_other_trees, files_iterable),
-                                      total=file_count, desc="MPT({}p)/Comparing checksums".format(self.num_procs)):
+        for file_path, status in pool.imap_unordered(_worker_task("_compare_checksum_file_to_other_trees"),
+                                                     files_iterable, self._chunksize(None, metadata_chunksize)):
+            progress.update()
             results_cache.append((file_path, status))
             if len(results_cache) >= self.cache_size:
                 for next_path, next_status in results_cache:
                     self.report_handler.assign_comparison_result(file_path=next_path, file_status=next_status)
                 self.report_handler.write_summary()
-                results_cache = []
+                results_cache.clear()
         # Write any records remaining in the cache after all files are processed
         for next_path, next_status in results_cache:
             self.report_handler.assign_comparison_result(file_path=next_path, file_status=next_status)
+        progress.close()
+        pool.close()
+        pool.join()
         self.report_handler.close()
         self._show_results()
 
@@ -512,28 +735,28 @@ class FileManager:
                                                 "manifest_file": self.manifest_file,
                                                 "formats": self.formats
                                             })
-        pool = multiprocessing.Pool(processes=self.num_procs)
+        pool = self._create_pool(max_tasks=hash_worker_max_tasks)
         files_iterable = scan_tree(path=self.primary_path, recursive=self.recursive, formats=self.formats)
+        progress = progress_bar(None, total=0 if self.count_files else None,
+                                desc="MPT({}p)/Creating checksums".format(self.num_procs))
         if self.count_files:
-            file_count = sum([1 for x in files_iterable])
-            files_iterable = scan_tree(path=self.primary_path, recursive=self.recursive, formats=self.formats)
-        else:
-            file_count = None
+            files_iterable = count_into(files_iterable, progress)
 
         results_cache = []
 
-        for file_path, status, file_size in tqdm(pool.imap_unordered(self._create_checksum_or_skip_file,
-                                                                     files_iterable), total=file_count,
-                                                 desc="MPT({}p)/Creating checksums".format(self.num_procs)):
+        for file_path, status, file_size in pool.imap_unordered(_worker_task("_create_checksum_or_skip_file"),
+                                                                files_iterable, self._chunksize(None, hash_chunksize)):
+            progress.update()
             results_cache.append((file_path, status, file_size))
             if len(results_cache) >= self.cache_size:
-                for next_path, next_status, next_size in results_cache:
-                    self.report_handler.add_result(description=next_status, data={"path": next_path, "size": next_size})
+                self.report_handler.add_results(results_cache)
                 self.report_handler.write_summary()
-                results_cache = []
+                results_cache.clear()
         # Write any records remaining in the cache after all files are processed
-        for next_path, next_status, next_size in results_cache:
-            self.report_handler.add_result(description=next_status, data={"path": next_path, "size": next_size})
+        self.report_handler.add_results(results_cache)
+        progress.close()
+        pool.close()
+        pool.join()
         self.report_handler.close()
         self._show_results()
 
@@ -550,7 +773,7 @@ class FileManager:
         if not os.path.exists(self.manifest_file):
             raise EnvironmentError("Manifest file " + self.manifest_file + " not found")
 
-        pool = multiprocessing.Pool(processes=self.num_procs)
+        pool = self._create_pool(max_tasks=hash_worker_max_tasks)
         files_iterable = scan_tree(path=self.primary_path, recursive=True)
         lines_iterable = iterate_manifest(self.manifest_file)
 
@@ -561,24 +784,28 @@ class FileManager:
 
         results_cache = []
 
-        for file_path, status, file_size in tqdm(
-                pool.imap_unordered(self._validate_file_with_checksum, lines_iterable),
+        for file_path, status, file_size in progress_bar(
+                pool.imap_unordered(_worker_task("_validate_file_with_checksum"), lines_iterable,
+                                    self._chunksize(file_count, hash_chunksize)),
                 total=file_count, desc="MPT({}p)/Validating files".format(self.num_procs)):
             results_cache.append((file_path, status, file_size))
             if len(results_cache) >= self.cache_size:
-                for next_path, next_status, next_size in results_cache:
-                    self.report_handler.add_result(description=next_status, data={"path": next_path, "size": next_size})
+                self.report_handler.add_results(results_cache)
                 self.report_handler.write_summary()
-                results_cache = []
+                results_cache.clear()
         # Write any records remaining in the cache after all files are processed
-        for next_path, next_status, next_size in results_cache:
-            self.report_handler.add_result(description=next_status, data={"path": next_path, "size": next_size})
-
-        # Look for data files not listed in manifest
-        for file_path, status in tqdm(pool.imap_unordered(self._check_for_file_in_manifest, files_iterable),
-                                      desc="MPT({}p)/Finding additional files".format(self.num_procs)):
+        self.report_handler.add_results(results_cache)
+        pool.close()
+        pool.join()
+
+        # Look for data files not listed in manifest. Each check is a single lookup in the manifest index, so this is
+        # done here rather than paying for a round trip to a worker per file
+        for data_file_path in progress_bar(files_iterable, desc="MPT/Finding additional files"):
+            file_path, status = self._check_for_file_in_manifest(data_file_path)
             if status is not None:
-                self.report_handler.add_result(status, {"path": "*{sep}{path}".format(sep=os.sep, path=file_path)})
+                self.report_handler.add_result(status, {"path": f"*{os.sep}{file_path}"})
+        # Dropped once the check is done, so that a later action reads the manifest afresh
+        _manifest_indexes.pop(self.manifest_file, None)
 
         self.report_handler.close()
         self._show_results()
@@ -596,34 +823,41 @@ class FileManager:
         if not os.path.exists(self.cs_dir):
             raise EnvironmentError("Checksum tree directory " + self.cs_dir + " not found")
 
-        pool = multiprocessing.Pool(processes=self.num_procs)
+        pool = self._create_pool(max_tasks=hash_worker_max_tasks)
         cs_files_iterable = scan_tree(path=self.cs_dir, recursive=self.recursive)
         data_files_iterable = scan_tree(path=self.primary_path, recursive=self.recursive)
 
+        progress = progress_bar(None, total=0 if self.count_files else None,
+                                desc="MPT({}p)/Validating files".format(self.num_procs))
         if self.count_files:
-            file_count = sum([1 for x in cs_files_iterable])
-            cs_files_iterable = scan_tree(path=self.cs_dir, recursive=self.recursive)
-        else:
-            file_count = None
+            cs_files_iterable = count_into(cs_files_iterable, progress)
 
         results_cache = []
-
-        for file_path, status, file_size in tqdm(pool.imap_unordered(self._validate_checksum_file, cs_files_iterable),
-                                     total=file_count, desc="MPT({}p)/Validating files".format(self.num_procs)):
+        # Note which data files have a checksum file while the checksum tree is read for validation, so that data
+        # files can then be checked against it without probing the tree once per supported algorithm
+        checksummed = set()
+        cs_files_iterable = self._note_checksummed_files(cs_files_iterable, checksummed)
+
+        results = pool.imap_unordered(_worker_task("_validate_checksum_file"), cs_files_iterable,
+                                      self._chunksize(None, hash_chunksize))
+        for file_path, status, file_size in results:
+            progress.update()
             results_cache.append((file_path, status, file_size))
             if len(results_cache) >= self.cache_size:
-                for next_path, next_status, next_size in results_cache:
-                    self.report_handler.add_result(description=next_status, data={"path": next_path, "size": next_size})
+                self.report_handler.add_results(results_cache)
                 self.report_handler.write_summary()
-                results_cache = []
+                results_cache.clear()
         # Write any records remaining in the cache after all files are processed
-        for next_path, next_status, next_size in results_cache:
-            self.report_handler.add_result(description=next_status, data={"path": next_path, "size": next_size})
-
-        # Look for data files with no checksum file
-        for file_path, status in tqdm(pool.imap_unordered(self._check_for_cs_file, data_files_iterable),
-                                      desc="MPT({}p/Finding additional files".format(self.num_procs)):
+        self.report_handler.add_results(results_cache)
+        progress.close()
+        pool.close()
+        pool.join()
+
+        # Look for data files with no checksum file. Each check is a single set lookup, so this is done here rather
+        # than paying for a round trip to a worker per file
+        for data_file_path in progress_bar(data_files_iterable, desc="MPT/Finding additional files"):
+            file_path, status = self._check_for_cs_file(data_file_path, checksummed)
             if status is not None:
-                self.report_handler.add_result(status, {"path": "*{sep}{path}".format(sep=os.sep, path=file_path)})
+                self.report_handler.add_result(status, {"path": f"*{os.sep}{file_path}"})
         self.report_handler.close()
         self._show_results()
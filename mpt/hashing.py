@@ -1,51 +1,294 @@
+import errno
+import functools
 import hashlib
+import mmap
+import os
+import queue
+import stat
+import threading
 import xxhash
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
+from .defaults import (default_algorithm, default_blocksize, default_processes, read_ahead_depth, use_mmap,
+                       use_o_direct)
 from .paths import fix_path
 
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
 algorithms_supported = set.union(hashlib.algorithms_guaranteed, xxhash.algorithms_available)
+if blake3 is not None:
+    algorithms_supported.add("blake3")
+
+# Hash object constructors by algorithm name, filled in as each algorithm is first used
+_hasher_constructors = {algorithm: getattr(xxhash, algorithm) for algorithm in xxhash.algorithms_available}
 
-def hash_files(file_list: List, algorithm: str = None, blocksize: int = None):
+def _hasher_constructor(algorithm: str):
     """
-    Hash all files in a list using the algorithm and blocksize specified
-    :param file_list: list of files to hash
+    Find the constructor for an algorithm's hash objects. The named hashlib constructors are backed by OpenSSL, which
+    selects SHA-NI / AVX2 code paths at runtime on CPUs that support them.
+    :param algorithm: the algorithm to use
+    :return: a callable returning a new hash object
+    """
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise ValueError("The blake3 algorithm requires the 'blake3' package to be installed")
+        return blake3.blake3
+    constructor = getattr(hashlib, algorithm, None)
+    if constructor is not None:
+        return constructor
+    # Raise for unknown algorithms now, rather than caching a constructor which always fails
+    hashlib.new(algorithm)
+    return functools.partial(hashlib.new, algorithm)
+
+def new_hasher(algorithm: str):
+    """
+    Create a new hash object for the given algorithm
     :param algorithm: the algorithm to use
+    :return: a hash object providing update() and hexdigest()
+    """
+    constructor = _hasher_constructors.get(algorithm)
+    if constructor is None:
+        constructor = _hasher_constructors[algorithm] = _hasher_constructor(algorithm)
+    return constructor()
+
+def hash_files(file_list: List, algorithm: str = None, blocksize: int = None, num_threads: int = None):
+    """
+    Hash all files in a list using the algorithm and blocksize specified. Files are hashed concurrently on a pool of
+    threads, as file reads and hash updates both release the GIL. Results are yielded as they become available, so
+    they can be written out while later files are still being hashed.
+    :param file_list: list of files to hash
+    :param algorithm: the algorithm to use [default: defaults.default_algorithm]
+    :param blocksize: block size to use
+    :param num_threads: the number of files to hash at once [default: defaults.default_processes]
+    :return: a generator of tuples in the form (path, (hash value, number of bytes hashed)), in the order of file_list
+    """
+    if algorithm is None:
+        algorithm = default_algorithm
+    if num_threads is None:
+        num_threads = default_processes
+    if num_threads > 1:
+        file_list = list(file_list)
+    if num_threads < 2 or len(file_list) < 2:
+        for f in file_list:
+            yield f, hash_file(f, algorithm, blocksize)
+        return
+    # Start with the largest files, so that a big file picked up last doesn't leave the other threads idle
+    order = sorted(range(len(file_list)), key=lambda i: os.path.getsize(fix_path(file_list[i])), reverse=True)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = [None] * len(file_list)
+        for i in order:
+            futures[i] = executor.submit(hash_file, file_list[i], algorithm, blocksize)
+        for i, f in enumerate(file_list):
+            result = futures[i].result()
+            # Release each result once it has been handed on
+            futures[i] = None
+            yield f, result
+
+# Read buffers kept for reuse by each thread
+_thread_buffers = threading.local()
+
+def _read_buffer(blocksize: int):
+    """
+    Get the calling thread's reusable read buffer, allocating a new one only when a larger buffer is needed, so that
+    hashing many small files doesn't allocate a fresh buffer for each one
+    :param blocksize: the minimum size of the buffer
+    :return: a bytearray of at least blocksize bytes
+    """
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None or len(buffer) < blocksize:
+        buffer = bytearray(blocksize)
+        _thread_buffers.buffer = buffer
+    return buffer
+
+def _read_blocks(file, blocksize: int):
+    """
+    A generator which reads a file into a single reusable buffer, avoiding the allocation of a new bytes object for
+    every block. Each block yielded is only valid until the next one is requested.
+    :param file: a file object opened in binary mode
+    :param blocksize: block size to use for file read
+    :return: an iterable sequence of memoryview blocks
+    """
+    with memoryview(_read_buffer(blocksize)) as buffer_view:
+        with buffer_view[:blocksize] as view:
+            while True:
+                n = file.readinto(view)
+                if not n:
+                    return
+                yield view[:n]
+
+def read_ahead(read, depth: int):
+    """
+    A generator which keeps up to a given number of blocks read ahead of the consumer on a background thread, so that
+    the latency of each read overlaps with hashing of the previous block. File reads and hash updates both release the
+    GIL, so the two proceed in parallel.
+    :param read: a callable returning the next block, or an empty bytes object at the end of the file
+    :param depth: maximum number of blocks to hold in memory
+    :return: an iterable sequence of blocks
+    """
+    blocks = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            while not stop.is_set():
+                block = read()
+                blocks.put(block)
+                if not block:
+                    return
+        except Exception as e:
+            blocks.put(e)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                return
+            yield block
+    finally:
+        # Unblock and wait for the reader so that the file is not closed beneath it
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+def mapped_blocks(file, blocksize: int):
+    """
+    A generator which yields a file in blocks from a read-only memory map, so that data is used straight from the page
+    cache without being copied into a buffer first. Each block yielded is only valid until the next one is requested.
+    :param file: a file object opened in binary mode
     :param blocksize: block size to use
-    :return: a list of tuples in the form (path, hash value)
+    :return: an iterable sequence of memoryview blocks
+    """
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        # Views must all be released before the mapping can be closed
+        with memoryview(mapped) as view:
+            for start in range(0, len(mapped), blocksize):
+                with view[start:start + blocksize] as block:
+                    yield block
+
+def preferred_blocksize(file_stat: os.stat_result):
+    """
+    Choose the block size for reading a file: the default block size, rounded up to a whole number of the
+    filesystem's preferred I/O blocks. Filesystems with very large blocks (e.g. GPFS, Lustre) are then read a complete
+    block at a time.
+    :param file_stat: the stat result for the open file
+    :return: the block size to use
+    """
+    # st_blksize is not reported on Windows
+    fs_blocksize = getattr(file_stat, "st_blksize", 0)
+    if fs_blocksize <= 0:
+        return default_blocksize
+    return -(-default_blocksize // fs_blocksize) * fs_blocksize
+
+def advise_sequential(fd: int):
+    """
+    Tell the kernel that a file will be read sequentially, so that it reads further ahead of each request. Not every
+    platform supports this, in which case it does nothing.
+    :param fd: the file descriptor of the open file
     """
-    result = []
-    for f in file_list:
-        cs = hash_file(f, algorithm, blocksize)
-        next_file = (f, cs)
-        result.append(next_file)
-    return result
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            # Advice is only a hint; some filesystems and file types reject it
+            pass
 
-def hash_file(in_path: str, algorithm: str = "sha256", blocksize: int = 131072):
+def advise_dont_need(fd: int):
+    """
+    Tell the kernel that a file's cached data won't be needed again, so that it can be dropped from the page cache.
+    Only data already written to storage is dropped. Not every platform supports this, in which case it does nothing.
+    :param fd: the file descriptor of the open file
+    """
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        except OSError:
+            pass
+
+def _hash_direct(path: str, hasher, blocksize: int = None):
+    """
+    Feed a file to a hash object using unbuffered O_DIRECT reads, bypassing the page cache
+    :param path: file to hash
+    :param hasher: the hash object to update
+    :param blocksize: block size to use for file read, rounded up to a multiple of the page size [default: chosen
+        by preferred_blocksize]
+    :return: the number of bytes hashed
+    """
+    size = 0
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECT)
+    try:
+        if blocksize is None:
+            blocksize = preferred_blocksize(os.fstat(fd))
+        blocksize = -(-blocksize // mmap.PAGESIZE) * mmap.PAGESIZE
+        # Anonymous mappings are page-aligned, as O_DIRECT requires
+        with mmap.mmap(-1, blocksize) as buffer:
+            with memoryview(buffer) as view:
+                while True:
+                    n = os.readv(fd, [buffer])
+                    if n == 0:
+                        break
+                    hasher.update(view[:n])
+                    size += n
+    finally:
+        os.close(fd)
+    return size
+
+def threads_per_process(processes: int):
+    """
+    Share the CPUs between a number of worker processes
+    :param processes: the number of worker processes hashing at once
+    :return: the number of hashing threads each process may use, at least 1
+    """
+    return max(1, (os.cpu_count() or 1) // processes)
+
+def hash_file(in_path: str, algorithm: str = "sha256", blocksize: int = None, max_threads: int = 1):
     """ Return checksum value for a given file
     :param in_path: file to hash
     :param algorithm: hash algorithm to use
-    :param blocksize: block size to use for file read
-    :param return_size: optional, return number of bytes hashed
-    :return: the hash value of the file
-    """
-    if algorithm in xxhash.algorithms_available:
-        if algorithm == "xxh32":
-            hasher = xxhash.xxh32()
-        elif algorithm == "xxh64":
-            hasher = xxhash.xxh64()
-        elif algorithm == "xxh128":
-            hasher = xxhash.xxh128()
-        elif algorithm == "xxh3_64":
-            hasher = xxhash.xxh3_64()
-        elif algorithm == "xxh3_128":
-            hasher = xxhash.xxh3_128()
-    else:
-        hasher = hashlib.new(algorithm)
+    :param blocksize: block size to use for file read [default: chosen for each file by preferred_blocksize]
+    :param max_threads: the number of threads which may hash a large file, where the algorithm supports it (blake3)
+    :return: a tuple in the form (hash value, number of bytes hashed)
+    """
+    hasher = new_hasher(algorithm)
     path = fix_path(in_path)
+    if use_o_direct and hasattr(os, "O_DIRECT"):
+        try:
+            size = _hash_direct(path, hasher, blocksize)
+            return hasher.hexdigest(), size
+        except OSError as e:
+            # Some filesystems (e.g. tmpfs) reject O_DIRECT; use buffered reads instead
+            if e.errno != errno.EINVAL:
+                raise
+            hasher = new_hasher(algorithm)
     size = 0
-    with open(path.encode('utf-8'), 'rb') as f:
-        for block in iter(lambda: f.read(blocksize), b""):
+    with open(path, 'rb') as f:
+        file_stat = os.fstat(f.fileno())
+        if blocksize is None:
+            blocksize = preferred_blocksize(file_stat)
+        if algorithm == "blake3" and max_threads > 1 and file_stat.st_size > blocksize:
+            # BLAKE3 can spread each update of a large file across several threads. The caller limits them to this
+            # process's share of the CPUs, as the other workers are hashing at the same time
+            hasher = blake3.blake3(max_threads=max_threads)
+        if use_mmap and stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > blocksize:
+            blocks = mapped_blocks(f, blocksize)
+        elif read_ahead_depth > 0 and file_stat.st_size > blocksize:
+            advise_sequential(f.fileno())
+            blocks = read_ahead(lambda: f.read(blocksize), read_ahead_depth)
+        else:
+            blocks = _read_blocks(f, blocksize)
+        for block in blocks:
             hasher.update(block)
             size += len(block)
     return hasher.hexdigest(), size
@@ -0,0 +1,43 @@
+import os
+from multiprocessing import util
+
+# Manifest files opened for appending, at most once per process and keyed by manifest path
+_manifest_writers = {}
+# The process in which closing the manifests at exit has been arranged. A forked worker starts without the
+# finalizers of its parent, so it arranges its own
+_closer_pid = None
+
+
+def manifest_writer(file_path: str):
+    """
+    Get a file object for appending records to a manifest, opening it on first use and reusing it for every later
+    record written by this process. Manifests are closed by close_manifest_writers, which also runs when the process
+    exits, including pool workers.
+    :param file_path: path to the manifest file
+    :return: the file object
+    """
+    global _closer_pid
+    writer = _manifest_writers.get(file_path)
+    if writer is None:
+        # Line buffering hands each record to the OS as a single append, so records written by different processes
+        # are never interleaved
+        writer = open(file_path, 'a', buffering=1, encoding='utf-8', errors="surrogateescape")
+        _manifest_writers[file_path] = writer
+        if _closer_pid != os.getpid():
+            # Pool workers leave through os._exit, which skips atexit handlers but still runs multiprocessing's own
+            # finalizers
+            util.Finalize(None, close_manifest_writers, exitpriority=10)
+            _closer_pid = os.getpid()
+    return writer
+
+
+def close_manifest_writers():
+    """
+    Close every manifest opened for appending by this process
+    """
+    while _manifest_writers:
+        _, writer = _manifest_writers.popitem()
+        try:
+            writer.close()
+        except OSError as e:
+            print(str(e))
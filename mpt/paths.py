@@ -1,21 +1,27 @@
 import sys
 
-def fix_path(path: str):
-    """
-    Insert a 'magic prefix' to any path longer than 259 characters.
-    Workaround for python-Bugs-542314
-    (https://mail.python.org/pipermail/python-bugs-list/2007-March/037810.html)
-    :param path: the original path
-    :return: the fixed path including a prefix if necessary
-    """
-    if sys.platform == "win32":
-        if len(path) > 259:
-            if '\\\\?\\' not in path:
-                if path.startswith("\\\\"):
-                    # Alternative prefix for UNC paths
-                    path = u'\\\\?\\UNC\\' + path[2:]
-                else:
-                    # Standard prefix for drive letter paths
-                    path = u'\\\\?\\' + path
-
-    return path
+if sys.platform == "win32":
+    def fix_path(path: str):
+        """
+        Insert a 'magic prefix' to any path longer than 259 characters.
+        Workaround for python-Bugs-542314
+        (https://mail.python.org/pipermail/python-bugs-list/2007-March/037810.html)
+        :param path: the original path
+        :return: the fixed path including a prefix if necessary
+        """
+        # Most paths are short enough to need no prefix
+        if len(path) <= 259 or path.startswith('\\\\?\\'):
+            return path
+        if path.startswith("\\\\"):
+            # Alternative prefix for UNC paths
+            return '\\\\?\\UNC\\' + path[2:]
+        # Standard prefix for drive letter paths
+        return '\\\\?\\' + path
+else:
+    def fix_path(path: str):
+        """
+        Paths only need fixing on Windows, so elsewhere the path is returned unchanged
+        :param path: the original path
+        :return: the original path
+        """
+        return path
@@ -1,4 +1,5 @@
 import csv
+import operator
 import os
 from datetime import datetime
 
@@ -12,6 +13,7 @@ class Report:
     """
     io_handler = None
     csv_handler = None
+    columns = None
 
     def __init__(self, path: str, columns: list):
         """
@@ -19,21 +21,46 @@ class Report:
         :param path: absolute file path for the report to be created
         :param columns: list of columns included in the report
         """
-        if not os.path.exists(os.path.dirname(path)):
-            try:
-                os.makedirs(os.path.dirname(path))
-            except FileExistsError:
-                pass
-        self.io_handler = open(path, 'w+', newline='', encoding='utf-8', errors="surrogateescape")
-        self.csv_handler = csv.DictWriter(self.io_handler, fieldnames=columns)
-        self.csv_handler.writeheader()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Reports can run to millions of rows, so write to the file in large blocks
+        self.io_handler = open(path, 'w+', buffering=1024 * 1024, newline='', encoding='utf-8',
+                               errors="surrogateescape")
+        # The columns are fixed, so each record is written as a plain row in column order rather than through a
+        # DictWriter, which also checks every record for unexpected keys
+        self.columns = tuple(columns)
+        if len(self.columns) == 1:
+            # itemgetter with a single key returns the bare value rather than a tuple
+            column = self.columns[0]
+            self._values = lambda data: (data[column],)
+        else:
+            self._values = operator.itemgetter(*self.columns)
+        self.csv_handler = csv.writer(self.io_handler)
+        self.csv_handler.writerow(self.columns)
+
+    def _row(self, data: dict):
+        """
+        Arrange one record's values in column order, leaving any missing columns empty
+        :param data: dictionary containing report data in the form { column_name: data }
+        :return: a sequence of values
+        """
+        try:
+            return self._values(data)
+        except KeyError:
+            return [data.get(column, "") for column in self.columns]
 
     def write(self, data: dict):
         """
         Write one record to the report's output file
         :param data: dictionary containing report data in the form { column_name: data }
         """
-        self.csv_handler.writerow(data)
+        self.csv_handler.writerow(self._row(data))
+
+    def write_rows(self, rows: list):
+        """
+        Write several records to the report's output file in one call
+        :param rows: list of dictionaries containing report data in the form { column_name: data }
+        """
+        self.csv_handler.writerows(map(self._row, rows))
 
     def close(self):
         """
@@ -53,6 +80,7 @@ class ReportHandler:
     stop_time = None
     errors_detected = False
     summary_data = {}
+    summary_file = None
     out_files = {}
     results = {}
     file_count = 0
@@ -103,24 +131,57 @@ class ReportHandler:
         """
         if description not in self.out_files:
             self.add_out_file(description=description, columns=[k for k, v in data.items() if v is not None])
-        self.out_files[description].write({k: v for k, v in data.items() if v is not None})
-        self.results[description]["count"] += 1
-        if "size" in data:
-            if data["size"] is not None:
-                self.results[description]["size"] += data["size"]
+        # The csv writer leaves None values empty, so the record can be written without filtering it first
+        self.out_files[description].write(data)
+        counts = self.results[description]
+        counts["count"] += 1
+        size = data.get("size")
+        if size is not None:
+            counts["size"] += size
+
+    def add_results(self, records: list):
+        """
+        Add the results of several checksum operations, writing each output file's new records in a single call
+        :param records: a list of tuples in the form (file path, Result object, file size), where the file size
+            may be None
+        """
+        rows = {}
+        sizes = {}
+        for path, description, size in records:
+            if size is None:
+                data = {"path": path}
+            else:
+                data = {"path": path, "size": size}
+                sizes[description] = sizes.get(description, 0) + size
+            group = rows.get(description)
+            if group is None:
+                group = rows[description] = []
+                if description not in self.out_files:
+                    self.add_out_file(description=description, columns=list(data))
+            group.append(data)
+        # Totals are updated once per result category rather than once per record
+        for description, data in rows.items():
+            self.out_files[description].write_rows(data)
+            self.results[description]["count"] += len(data)
+        for description, size in sizes.items():
+            self.results[description]["size"] += size
 
     def write_summary(self):
         """
-        Write out the summary of this MPT run's results to a text file
+        Write out the summary of this MPT run's results to a text file. The summary is rewritten each time results are
+        added during a run, so the file is kept open until the summary written after the run completes.
         """
-        if not os.path.exists(self.out_dir):
-            try:
-                os.makedirs(self.out_dir)
-            except FileExistsError:
-                pass
-        out_path = os.path.join(self.out_dir, "summary.txt")
-        with open(out_path, "w+") as out_file:
-            out_file.write(self.summary())
+        if self.summary_file is None:
+            os.makedirs(self.out_dir, exist_ok=True)
+            self.summary_file = open(os.path.join(self.out_dir, "summary.txt"), "w", encoding="utf-8",
+                                     errors="surrogateescape")
+        self.summary_file.seek(0)
+        self.summary_file.write(self.summary())
+        self.summary_file.truncate()
+        self.summary_file.flush()
+        if self.stop_time is not None:
+            self.summary_file.close()
+            self.summary_file = None
 
     def assign_comparison_result(self, file_path: str, file_status: dict):
         """
@@ -1,16 +1,33 @@
-import hashlib
 import multiprocessing
 import os
+import stat
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List
 
-from tqdm import tqdm
-
 from .codes import StagingStatus
 from .defaults import *
 from .email import send_email
-from .hashing import hash_file
+from .filemanager import progress_bar, suffix_tuple
+from .hashing import (advise_dont_need, advise_sequential, hash_file, mapped_blocks, new_hasher, preferred_blocksize,
+                      read_ahead)
+from .manifests import manifest_writer
+
+
+# Threads for writing to and reading back destination files, created once in each worker process
+_destination_pools = {}
+
+
+def _destination_pool(workers: int):
+    """
+    Get the calling process's thread pool for working on a given number of destinations at once
+    :param workers: the number of destination files written or read back at once
+    :return: a ThreadPoolExecutor
+    """
+    if workers not in _destination_pools:
+        _destination_pools[workers] = ThreadPoolExecutor(max_workers=workers)
+    return _destination_pools[workers]
 
 
 class FileStager():
@@ -19,28 +36,34 @@ class FileStager():
     """
     source = None
     checksum = None
+    size = None
     algorithm = None
-    blocksize = 0
+    blocksize = None
     destinations = {}
     remove_original = None
+    verify_writes = True
 
     def __init__(self,
                  source: str,
                  destinations: List,
                  algorithm: str = default_algorithm,
-                 blocksize: int = default_blocksize,
-                 remove_original: bool = True):
+                 blocksize: int = None,
+                 remove_original: bool = True,
+                 verify_writes: bool = True):
         """
         Initialise the class instance
         :param source: path to the source filename
         :param destinations: list of destinations (data directories, checksum directories and manifests)
         :param algorithm: the hashing algorithm to use
-        :param blocksize: the blocksize to use when hashing/copying files
+        :param blocksize: the blocksize to use when hashing/copying files [default: chosen for each file by
+            hashing.preferred_blocksize]
         :param remove_original:  remove the original file when all operations complete
+        :param verify_writes: read back each destination file to check it against the source checksum
         """
         self.algorithm = algorithm
         self.blocksize = blocksize
         self.remove_original = remove_original
+        self.verify_writes = verify_writes
         self.next_file(source, destinations)
 
     def next_file(self, source: str, destinations: List):
@@ -60,6 +83,7 @@ class FileStager():
             f["root_path"]: {
                 "data_file": f["destination"],
                 "checksum_file": f["checksum"],
+                "checksum_root": f.get("checksum_root"),
                 "checksum_value": None,
                 "manifest_file": f["manifest"],
                 "status": StagingStatus.READY,
@@ -112,58 +136,45 @@ class FileStager():
         :return: True if all file handlers are in a READY state, False otherwise
         """
         for k, v in self.destinations.items():
-            if os.path.exists(v["data_file"]):
+            if os.path.exists(v["checksum_file"]):
+                # A data file which is also present is still reported as the duplicate, as it always has been
+                if os.path.exists(v["data_file"]):
+                    v["status"] = StagingStatus.DUPLICATE_FILE
+                else:
+                    v["status"] = StagingStatus.DUPLICATE_CHECKSUM
+                continue
+            # Data files are created exclusively, so an existing file is found by the open itself rather than by
+            # checking for it first
+            try:
+                v["handler"] = self._open_file(v["data_file"])
+            except FileExistsError:
                 v["status"] = StagingStatus.DUPLICATE_FILE
-            elif os.path.exists(v["checksum_file"]):
-                v["status"] = StagingStatus.DUPLICATE_CHECKSUM
+            except Exception as e:
+                v["status"] = StagingStatus.DATA_WRITE_FAILURE
+                v["substatus"] = str(e)
             else:
-                try:
-                    v["handler"] = self._open_file(v["data_file"])
-                except Exception as e:
-                    v["status"] = StagingStatus.DATA_WRITE_FAILURE
-                    v["substatus"] = str(e)
-                else:
-                    v["status"] = StagingStatus.READY
+                v["status"] = StagingStatus.READY
         return self.ready()
 
     def _open_file(self, path: str, binary: bool = True, can_exist=False):
         """
-        Open a file and return a file object
+        Open a file and return a file object, creating its directory first if necessary
         :param path: path to the file
         :param binary: open the file in binary mode - otherwise open as text
         :param can_exist: allow appending to an existing file - otherwise only allow creation of a new file
         :return: the opened file object
         """
-        if not os.path.exists(os.path.dirname(path)):
-            try:
-                os.makedirs(os.path.dirname(path))
-            except FileExistsError:
-                pass
         if can_exist:
-            if binary:
-                options = 'ab+'
-            else:
-                options = 'a+'
+            options = 'ab+' if binary else 'a+'
         else:
-            if binary:
-                options = 'xb'
-            else:
-                options = 'x'
-        if not binary:
-            encoding = "utf-8"
-        else:
-            encoding = None
-
-        for n in range(1, 5):
-            try:
-                if encoding is None:
-                    handler = open(path, options)
-                else:
-                    handler = open(path, options, encoding=encoding)
-            except FileNotFoundError:
-                continue
-            finally:
-                return handler
+            options = 'xb' if binary else 'x'
+        encoding = None if binary else "utf-8"
+        try:
+            return open(path, options, encoding=encoding)
+        except FileNotFoundError:
+            # The directory usually exists already, so it is only created when opening the file fails
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, options, encoding=encoding)
 
     def undo_staging(self):
         """
@@ -173,23 +184,25 @@ class FileStager():
             if v["handler"] is not None:
                 v["handler"].close()
                 v["handler"] = None
+            # The files found at a duplicate destination were already there, so they are left in place
+            if v["status"] in [StagingStatus.DUPLICATE_FILE, StagingStatus.DUPLICATE_CHECKSUM]:
+                continue
             try:
-                os.remove(v["data_file"])
-                os.remove(v["checksum_file"])
+                for path in (v["data_file"], v["checksum_file"]):
+                    if path is not None:
+                        try:
+                            os.remove(path)
+                        except FileNotFoundError:
+                            pass
             except Exception as e:
                 v["status"] = StagingStatus.COULD_NOT_REMOVE
                 v["substatus"] = str(e)
             else:
                 if v["status"] in [StagingStatus.READY, StagingStatus.IN_PROGRESS, StagingStatus.STAGED]:
                     v["status"] = StagingStatus.UNSTAGED
-                old_dir = os.getcwd()
-                os.chdir(k)
-                try:
-                    os.removedirs(os.path.dirname(v["data_file"]))
-                    os.removedirs(os.path.dirname(v["checksum_file"]))
-                except OSError:
-                    pass
-                os.chdir(old_dir)
+                _prune_up(k, v["data_file"])
+                if v["checksum_file"] is not None and v["checksum_root"] is not None:
+                    _prune_up(v["checksum_root"], v["checksum_file"])
 
     def write_files(self):
         """
@@ -197,26 +210,83 @@ class FileStager():
         in the process
         :return: True if any file writes have failed, False otherwise
         """
-        hasher = hashlib.new(self.algorithm)
+        hasher = new_hasher(self.algorithm)
         for v in self.destinations.values():
             v["status"] = StagingStatus.IN_PROGRESS
         with open(self.source, "rb") as in_file:
-            for block in iter(lambda: in_file.read(self.blocksize), b''):
-                hasher.update(block)
-                for k, v in self.destinations.items():
-                    try:
-                        v["handler"].write(block)
-                    except Exception as e:
-                        v["status"] = StagingStatus.DATA_WRITE_FAILURE
-                        v["substatus"] = str(e)
+            file_stat = os.fstat(in_file.fileno())
+            self.size = file_stat.st_size
+            blocksize = self.blocksize
+            if blocksize is None:
+                blocksize = preferred_blocksize(file_stat)
+            if use_mmap and stat.S_ISREG(file_stat.st_mode) and file_stat.st_size > blocksize:
+                blocks = mapped_blocks(in_file, blocksize)
+            elif read_ahead_depth > 0 and file_stat.st_size > blocksize:
+                advise_sequential(in_file.fileno())
+                # Read the next blocks on a background thread while the current one is hashed and written out
+                blocks = read_ahead(lambda: in_file.read(blocksize), read_ahead_depth)
+            else:
+                blocks = iter(lambda: in_file.read(blocksize), b'')
+            # Everything used for each block is looked up once, before the copy starts
+            update = hasher.update
+            writers = [(v, v["handler"].write) for v in self.destinations.values()]
+            if len(writers) > 1:
+                # Destinations are usually on separate storage, so each block is written to all of them at once
+                submit = _destination_pool(len(writers)).submit
+            else:
+                submit = None
+            write_failed = False
+            try:
+                for block in blocks:
+                    if submit is None:
+                        writes = [(v, write, None) for v, write in writers]
+                    else:
+                        writes = [(v, write, submit(write, block)) for v, write in writers]
+                    # The block is hashed while the destination writes submitted above are running
+                    update(block)
+                    for v, write, future in writes:
+                        try:
+                            if future is None:
+                                write(block)
+                            else:
+                                future.result()
+                        except Exception as e:
+                            v["status"] = StagingStatus.DATA_WRITE_FAILURE
+                            v["substatus"] = str(e)
+                            write_failed = True
+                    if write_failed:
                         break
-                if self.failed():
-                    break
+            finally:
+                # A failed write leaves the loop early, so the read-ahead thread is stopped (or the memory map
+                # released) here, before the source file is closed beneath it
+                if hasattr(blocks, "close"):
+                    blocks.close()
+            if file_stat.st_size >= uncached_staging_threshold:
+                # The source is read once and never again, so its pages are of no further use once copied
+                advise_dont_need(in_file.fileno())
+        if not self.failed() and file_stat.st_size >= uncached_staging_threshold:
+            self._write_through_destination_files()
         if not self.failed():
             self.checksum = hasher.hexdigest()
         self.close_destination_files()
         return self.failed()
 
+    def _write_through_destination_files(self):
+        """
+        Write all destination files through to storage and drop them from the page cache, so that large copies which
+        won't be read again soon don't push out cached data which is still in use. Verification then reads each copy
+        back from storage rather than from memory.
+        """
+        for v in self.destinations.values():
+            try:
+                v["handler"].flush()
+                os.fsync(v["handler"].fileno())
+            except OSError as e:
+                v["status"] = StagingStatus.DATA_WRITE_FAILURE
+                v["substatus"] = str(e)
+            else:
+                advise_dont_need(v["handler"].fileno())
+
     def close_destination_files(self):
         """
         Close all open file handlers
@@ -227,14 +297,25 @@ class FileStager():
 
     def check_files(self):
         """
-        Calculate the hex digest value for all destination files and compare it to that of the source file.
+        Calculate the hex digest value for all destination files and compare it to that of the source file, unless
+        verification is turned off, in which case each destination is given the source file's checksum.
         Create destination checksum files in the appropriate locations and update the manifest file, if applicable.
         :return: True if any failures have occurred, False otherwise
         """
         if self.checksum is None:
             return False
-        for k, v in self.destinations.items():
-            next_cs, _ = hash_file(v["data_file"])
+        data_files = [v["data_file"] for v in self.destinations.values()]
+        if not self.verify_writes:
+            checksums = [self.checksum] * len(data_files)
+        elif len(data_files) < 2 or self.size <= (self.blocksize or default_blocksize):
+            # A copy read in a single block is hashed faster than it can be handed to another thread
+            checksums = [hash_file(f, self.algorithm, self.blocksize)[0] for f in data_files]
+        else:
+            # Larger copies are read back from every destination at once, as they are usually on separate storage
+            submit = _destination_pool(len(data_files)).submit
+            futures = [submit(hash_file, f, self.algorithm, self.blocksize) for f in data_files]
+            checksums = [future.result()[0] for future in futures]
+        for (k, v), next_cs in zip(self.destinations.items(), checksums):
             v["checksum_value"] = next_cs
             if next_cs != self.checksum:
                 v["status"] = StagingStatus.CHECKSUM_MISMATCH
@@ -271,9 +352,19 @@ class FileStager():
             out_file = dest_data["checksum_file"]
             data_path = os.path.basename(dest_data["data_file"])
         cs_value = dest_data["checksum_value"]
+        record = "{0} *\\{1}\n".format(cs_value, data_path)
         try:
-            with self._open_file(out_file, binary=False, can_exist=manifest_file) as o:
-                o.write("{0} *\\{1}\n".format(cs_value, data_path))
+            if manifest_file:
+                # Each worker keeps its manifests open, rather than opening them again for every file staged
+                try:
+                    manifest = manifest_writer(out_file)
+                except FileNotFoundError:
+                    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+                    manifest = manifest_writer(out_file)
+                manifest.write(record)
+            else:
+                with self._open_file(out_file, binary=False) as o:
+                    o.write(record)
         except Exception as e:
             dest_data["status"] = StagingStatus.CHECKSUM_WRITE_FAILURE
             dest_data["substatus"] = str(e)
@@ -305,97 +396,98 @@ def _remove_empty_folders(path, remove_root=True):
     :param path: the root path
     :param remove_root: True if the root directory itself should be deleted
     """
-    if not os.path.isdir(path):
-        return
-
-    files = os.listdir(path)
-    if len(files):
-        for f in files:
-            fullpath = os.path.join(path, f)
-            if os.path.isdir(fullpath):
-                _remove_empty_folders(fullpath)
-
-    files = os.listdir(path)
-    if len(files) == 0 and remove_root:
-        os.rmdir(path)
+    # Walking bottom-up means each directory is reached after everything beneath it has been removed
+    for root, dirs, files in os.walk(path, topdown=False):
+        if files or (root == path and not remove_root):
+            continue
+        try:
+            # Fails if a subdirectory is still present, which is cheaper than listing the directory again
+            os.rmdir(root)
+        except OSError:
+            pass
 
 
-def _count_files(path: str, formats: List = None, recursive: bool = True):
-    """ Counts the number of files within the specified directory
-    :param path: the top level path to count files in
-    :param formats: a list of file endings to count; if omitted, count all files
-    :param recursive: true if counting should include sub-directories
-    :return: the number of files in the specified path
+def _prune_up(root: str, leaf: str):
     """
-    count = 0
-    try:
-        for p in os.scandir(path):
-            if p.is_file():
-                if formats is None:
-                    count += 1
-                else:
-                    if (p.path.endswith(tuple(formats))):
-                        count += 1
-            if recursive and p.is_dir():
-                count += _count_files(p.path, formats=formats, recursive=recursive)
-    except (IOError, OSError) as e:
-        print("Permission Error ({0}): {1} for {2}".format(e.errno, e.strerror, path))
-    return count
+    Delete the empty directories containing a file, working upwards but stopping short of the given root.
+    :param root: the root path, which is never deleted
+    :param leaf: path to a file beneath the root
+    """
+    rel = os.path.relpath(os.path.dirname(leaf), root)
+    if rel == os.curdir or rel.startswith(os.pardir):
+        return
+    parts = rel.split(os.sep)
+    for i in range(len(parts), 0, -1):
+        try:
+            # Fails once a directory still holds other files, and everything above it is then kept as well
+            os.rmdir(os.path.join(root, *parts[:i]))
+        except OSError:
+            break
 
 
-def _get_files_to_stage(directory: str, target_roots: List, checksum_roots: List, manifest_files: List,
-                        algorithm: str = None, formats: List = None, recursive: bool = True):
+def _get_files_to_stage(directory: str, formats: List = None, recursive: bool = True):
     """ Create a generator to iterate all files in a directory
     :param directory: the root directory to traverse
-    :param target_roots: a list of root directories to which the file should be copied
-    :param checksum_roots: a list of root directories in which checksums should be created
-    :param manifest_files: a list of manifest files to update
-    :param algorithm: the algorithm to use for hashing
     :param formats: a list of file endings to list; if omitted, list all files
     :param recursive: true if listing should include sub-directories
-    :return: an iterable containing all matching files
+    :return: an iterable of tuples in the form (source file path, path relative to the root directory)
     """
-
-    if algorithm is None:
-        algorithm = default_algorithm
+    # Built once, rather than for every file checked
+    suffixes = suffix_tuple(formats)
     if os.path.isdir(directory):
         for root, dirs, files in os.walk(directory):
-            if formats is None:
+            if suffixes is None:
                 filtered_files = files
             else:
-                filtered_files = [file for file in files if (file.endswith(tuple(formats)))]
+                filtered_files = [file for file in files if file.endswith(suffixes)]
             for f in filtered_files:
                 source_file = os.path.join(root, f)
-                r_path = os.path.relpath(source_file, directory)
-                index = 0
-                dest_dicts = []
-                for target_root in target_roots:
-                    dest_file = os.path.join(target_root, r_path)
-                    dest_dict = {
-                        "root_path": u"{}".format(target_root),
-                        "destination": u"{}".format(dest_file),
-                        "checksum": None,
-                        "manifest": None,
-                    }
-                    if len(checksum_roots) > 0:
-                        cs_root = checksum_roots[index]
-                        cs_file = u"{}".format(os.path.join(cs_root, "{0}.{1}".format(r_path, algorithm)))
-                        dest_dict["checksum"] = cs_file
-                    if len(manifest_files) > 0:
-                        manifest_file = u"{}".format(manifest_files[index])
-                        dest_dict["manifest"] = manifest_file
-                    dest_dicts.append(dest_dict)
-                    index += 1
-                file = {
-                    "source": source_file,
-                    "algorithm": algorithm,
-                    "destinations": dest_dicts
-                }
-                yield(file)
+                yield source_file, os.path.relpath(source_file, directory)
             if not recursive:
                 return
 
 
+def _staging_destinations(r_path: str, settings: Dict):
+    """ List the destinations to which a file should be staged
+    :param r_path: the path of the file relative to the staging directory
+    :param settings: a dictionary of staging settings, as passed to _init_worker
+    :return: a list of dictionaries containing the destination root, data file, checksum file and manifest file
+    """
+    checksum_roots = settings["checksum_roots"]
+    manifest_files = settings["manifest_files"]
+    dest_dicts = []
+    for index, target_root in enumerate(settings["target_roots"]):
+        dest_dict = {
+            "root_path": target_root,
+            "destination": os.path.join(target_root, r_path),
+            "checksum": None,
+            "checksum_root": None,
+            "manifest": None,
+        }
+        if len(checksum_roots) > 0:
+            dest_dict["checksum"] = os.path.join(checksum_roots[index], "{0}.{1}".format(r_path, settings["algorithm"]))
+            dest_dict["checksum_root"] = checksum_roots[index]
+        if len(manifest_files) > 0:
+            dest_dict["manifest"] = manifest_files[index]
+        dest_dicts.append(dest_dict)
+    return dest_dicts
+
+
+# Staging settings shared by every file, set in each worker process by _init_worker
+_worker_settings = None
+
+
+def _init_worker(settings: Dict):
+    """
+    Pool initializer: keep the staging settings in the worker process, so that they are transferred once per worker
+    rather than with every file
+    :param settings: a dictionary containing the target roots, checksum roots, manifest files, algorithm, blocksize and
+        whether to verify writes
+    """
+    global _worker_settings
+    _worker_settings = settings
+
+
 def _confirm_staging_targets(staging_summary: Dict):
     """ Print a summary of planned staging actions, including manifest and checksum files, and prompt for confirmation
     :param staging_summary: a dictionary containin a summary of all staging directories and files
@@ -420,23 +512,25 @@ def _confirm_staging_targets(staging_summary: Dict):
         return False
 
 
-def _stage_file(next_file: Dict):
+def _stage_file(next_file: tuple):
     """
     Instantiate the FileStager object and begin staging for a given file
-    :param next_file: a dictionary containing the file and directory names used for staging the file
+    :param next_file: a tuple in the form (source file path, path relative to the staging directory)
     :return: a triple consisting of the original file name, the staging status, and the details of all destinations
     """
-    fs = FileStager(source=next_file["source"], destinations=next_file["destinations"],
-                    algorithm=next_file["algorithm"])
+    source, r_path = next_file
+    fs = FileStager(source=source, destinations=_staging_destinations(r_path, _worker_settings),
+                    algorithm=_worker_settings["algorithm"], blocksize=_worker_settings["blocksize"],
+                    verify_writes=_worker_settings["verify_writes"])
     fs.start_copy()
     if fs.completed():
-        result = (next_file["source"], "staged", fs.destinations)
+        result = (source, "staged", fs.destinations)
     elif fs.aborted():
-        result = (next_file["source"], "aborted", fs.destinations)
+        result = (source, "aborted", fs.destinations)
     elif fs.failed():
-        result = (next_file["source"], "failed", fs.destinations)
+        result = (source, "failed", fs.destinations)
     else:
-        result = (next_file["source"], "unknown", fs.destinations)
+        result = (source, "unknown", fs.destinations)
     return result
 
 
@@ -513,23 +607,35 @@ def stage_files(args: Namespace):
     if not stg_continue:
         return 1
 
-    # Build a generator to list all files to be staged, along with their staging destinations, checksum
-    # destination and manifest files
-    files_iterable = _get_files_to_stage(directory=args.dir, target_roots=targets, checksum_roots=checksums,
-                                         manifest_files=args.manifests)
+    # Build a generator to list all files to be staged. The staging destinations, checksum destinations and manifest
+    # files are the same for every file, so are sent to each worker process once when it starts
+    files_iterable = _get_files_to_stage(directory=args.dir)
+    settings = {
+        "target_roots": targets,
+        "checksum_roots": checksums,
+        "manifest_files": args.manifests,
+        "algorithm": args.algorithm,
+        "blocksize": args.blocksize,
+        "verify_writes": args.verify_writes
+    }
 
     # Create a multiprocessing pool with the appropriate number of processes
-    pool = multiprocessing.Pool(processes=args.processes)
+    pool = multiprocessing.Pool(processes=args.processes, initializer=_init_worker, initargs=(settings,))
 
     if args.count_files:
-        file_count = _count_files(path=args.dir)
+        # Keep the files found while counting, rather than walking the staging directory a second time
+        files_iterable = list(files_iterable)
+        file_count = len(files_iterable)
+        chunksize = max(1, min(hash_chunksize, file_count // (args.processes * 4)))
     else:
         file_count = None
+        chunksize = max(1, hash_chunksize // 4)
 
     # Have the multiprocessing pool pass each item returned by the generator to stage_files and monitor
-    # progress via tqdm
-    for file, status, destinations in tqdm(pool.imap_unordered(_stage_file, files_iterable), total=file_count,
-                                           desc="MPT({}p)/Staging files".format(args.processes)):
+    # progress through the same progress bar as the other actions
+    for file, status, destinations in progress_bar(pool.imap_unordered(_stage_file, files_iterable, chunksize),
+                                                   total=file_count,
+                                                   desc="MPT({}p)/Staging files".format(args.processes)):
         # Terminate processing if the failure threshold has been exceeded
         terminate = _add_to_results(results, file, status, destinations)
         if terminate:
@@ -641,25 +747,21 @@ def _write_csv_files_from_dictionary(args: Namespace, dictionary: Dict, output_d
             if isinstance(v, list):
                 if len(v) > 0:
                     file_name = k + ".csv"
-                    with open(os.path.join(output_dir,file_name), 'w', encoding='utf=8',newline='') as csv_file:
+                    with open(os.path.join(output_dir, file_name), 'w', buffering=1024 * 1024, encoding='utf-8',
+                              newline='') as csv_file:
                         if isinstance(v[0], dict):
                             output = csv.DictWriter(csv_file, fieldnames=v[0].keys())
                             output.writeheader()
+                            output.writerows(v)
+                        elif args.abspath:
+                            csv.writer(csv_file).writerows([el.replace("*\\", args.dir + "\\")] for el in v)
                         else:
-                            output = csv.writer(csv_file)
-                        for el in v:
-                            if isinstance(el, dict):
-                                output.writerow(el)
-                            else:
-                                if self.absolute_path:
-                                    output.writerow([el.replace("*\\",args.dir + "\\")])
-                                else:
-                                    output.writerow([el])
+                            csv.writer(csv_file).writerows([el] for el in v)
             elif isinstance(v, dict):
                 if next(iter(v.values())) is None:
-                    _write_csv_files_from_dictionary(dictionary={k: list(v.keys())}, output_dir=output_dir)
+                    _write_csv_files_from_dictionary(args=args, dictionary={k: list(v.keys())}, output_dir=output_dir)
                 else:
-                    _write_csv_files_from_dictionary(dictionary=v, output_dir=output_dir)
+                    _write_csv_files_from_dictionary(args=args, dictionary=v, output_dir=output_dir)
             else:
                 pass
     except StopIteration:
@@ -1,34 +1,38 @@
 import csv
 import multiprocessing
 import os
+from collections import namedtuple
 from datetime import datetime
 
-from tqdm import tqdm
-
-from mpt.defaults import base_output_dir
+from mpt.defaults import base_output_dir, metadata_chunksize
 from mpt.email import send_email
-from mpt.filemanager import scan_tree
-
-
-def split_all(path):
-    allparts = []
-    while 1:
-        parts = os.path.split(path)
-        if parts[0] == path: # sentinel for absolute paths
-            allparts.insert(0, parts[0])
-            break
-        elif parts[1] == path: # sentinel for relative paths
-            allparts.insert(0, parts[1])
-        else:
-            path = parts[0]
-            allparts.insert(0, parts[1])
-    return allparts
+from mpt.filemanager import progress_bar, scan_tree
+
+# One line of a summary's results, in the column order of the collated report
+Status = namedtuple("Status", ["file_status", "file_count", "file_size"])
 
 
 def convert_time_string(time_string: str):
-    split_time = time_string.split(":")
-    seconds = (int(split_time[0]) * 3600) + (int(split_time[1]) * 60) + int(split_time[2])
-    return seconds
+    hours, minutes, seconds = time_string.split(":", 2)
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def parse_run_time(run_dir: str):
+    # Report directories are always named in the same "yyyy-mm-ddTHHMM" form, so the fields are sliced out directly
+    # rather than parsed with strptime; anything else still goes to strptime, which rejects it
+    if len(run_dir) == 15 and run_dir[4] == run_dir[7] == "-" and run_dir[10] == "T" and run_dir.isascii():
+        return datetime(int(run_dir[0:4]), int(run_dir[5:7]), int(run_dir[8:10]), int(run_dir[11:13]),
+                        int(run_dir[13:15]))
+    return datetime.strptime(run_dir, "%Y-%m-%dT%H%M")
+
+
+def report_rows(results: list):
+    for item in results:
+        # The columns shared by every status of a result are gathered once, in column order
+        base = (item["datetime"], item["hostname"], item["action"], item["path"],
+                item["time_taken"], item["total_files"])
+        for status in item["status"]:
+            yield base + status
 
 
 class ReportCollator:
@@ -38,8 +42,7 @@ class ReportCollator:
     date_end = None
     out_file = None
     email_recipients = None
-    results = []
-    results_sorted = {}
+    hostname = None
 
     def __init__(self,
                  base_path: str = None,
@@ -54,11 +57,12 @@ class ReportCollator:
         if date_start is None:
             self.date_start = datetime(1970, 1, 1, 0, 0, 0)
         else:
-            self.date_start = datetime.strptime(date_start, "yyyymmdd")
+            self.date_start = datetime.strptime(date_start, "%Y%m%d")
         if date_end is None:
             self.date_end = datetime.now()
         else:
-            self.date_end = datetime.strptime(date_end, "yyyymmdd")
+            # Runs are timed to the minute, so every run on the finishing date is included
+            self.date_end = datetime.strptime(date_end, "%Y%m%d").replace(hour=23, minute=59)
         self.out_file = out_file
         self.email_recipients = email_recipients
         try:
@@ -67,6 +71,14 @@ class ReportCollator:
             self.num_procs = 2
             pass
 
+    def _to_collate(self, file_path: str):
+        run_dir = os.path.dirname(file_path)
+        # Staging summaries are never collated, and staging always writes them beneath a folder of their own
+        if os.path.basename(os.path.dirname(run_dir)) == "staging_reports":
+            return False
+        run_time = parse_run_time(os.path.basename(run_dir))
+        return self.date_start <= run_time <= self.date_end
+
     def _parse_file(self, file_path: str):
         result = {
             "datetime": None,
@@ -77,72 +89,81 @@ class ReportCollator:
             "total_files": None,
             "status": []
         }
-        path_parts = split_all(file_path)
-        result["datetime"] = datetime.strptime(path_parts[-2], "%Y-%m-%dT%H%M")
+        # Each summary is in a directory named for the time the run started
+        run_dir = os.path.basename(os.path.dirname(file_path))
+        result["datetime"] = parse_run_time(run_dir)
         skip = False
         if self.date_start <= result["datetime"] <= self.date_end:
-            with open(file_path, 'r') as in_file:
-                next_line = in_file.readline().strip()
+            # Summaries are small, so each is read in one call and split into lines, rather than line by line
+            with open(file_path, 'r', encoding='utf-8', errors='replace') as in_file:
+                lines = iter(in_file.read().split("\n"))
+                next_line = next(lines, "").strip()
                 result["hostname"] = next_line.split(" ")[-1]
-                for next_line in in_file.readlines():
+                add_status = result["status"].append
+                for next_line in lines:
                     next_line = next_line.strip()
-                    if next_line != "":
-                        if "results" in next_line:
-                            result["action"], result["path"] = next_line.split(" results for ")
-                            if result["action"] == "File staging":
-                                return None
+                    if not next_line:
+                        continue
+                    # Checked cheapest first: fixed prefixes, then the action line, which is only looked for
+                    # until it has been found
+                    if next_line.startswith("Time taken"):
+                        time_str = next_line.split(": ")[-1]
+                        result["time_taken"] = time_str
+                    elif next_line.startswith("Detailed reports created"):
+                        pass
+                    elif next_line.startswith("MPT processing still ongoing"):
+                        # Runs still in progress are not collated, so the rest of the summary isn't parsed
+                        return None
+                    elif result["action"] is None and " results for " in next_line:
+                        result["action"], result["path"] = next_line.split(" results for ", 1)
+                        if result["action"] == "File staging":
+                            return None
+                    elif ": " in next_line:
+                        try:
+                            file_status, file_results = next_line.rsplit(": ", 1)
+                        except Exception as e:
+                            print(f"Error in file: {file_path}, text: '{next_line}'")
+                            raise e
+                        if "(" in file_results:
+                            file_count, file_size = file_results.split(" (")
+                            file_count = int("".join(c for c in file_count if c.isdigit()))
+                            file_size = int("".join(c for c in file_size if c.isdigit()))
                         else:
-                            if ": " in next_line:
-                                if "ongoing" in next_line:
-                                    skip = True
-                                elif "reports created" in next_line:
-                                    pass
-                                elif "Time taken" in next_line:
-                                    time_str = next_line.split(": ")[-1]
-                                    result["time_taken"] = time_str
-                                else:
-                                    try:
-                                        file_status, file_results = next_line.rsplit(": ", 1)
-                                    except Exception as e:
-                                        print(f"Error in file: {file_path}, text: '{next_line}'")
-                                        raise e
-                                    status = {
-                                        "file_status": file_status,
-                                        "file_count": None,
-                                        "file_size": None
-                                    }
-                                    if "(" in file_results:
-                                        file_count, file_size = file_results.split(" (")
-                                        status["file_count"] = int("".join(c for c in file_count if c.isdigit()))
-                                        status["file_size"] = int("".join(c for c in file_size if c.isdigit()))
-                                    else:
-                                        status["file_count"] = int(file_results.replace(",",""))
-                                    result["status"].append(status)
+                            file_count = int(file_results.replace(",",""))
+                            file_size = None
+                        add_status(Status(file_status, file_count, file_size))
         else:
             skip = True
         if not skip:
-            result["total_files"] = sum([n["file_count"] for n in result["status"]])
+            result["total_files"] = sum(n.file_count for n in result["status"])
             return result
 
-    def _write_report(self):
+    def _collect(self, results):
+        for result in results:
+            if result is not None:
+                # Only the host name is kept, for the e-mail; each result is written out as soon as it arrives
+                if self.hostname is None:
+                    self.hostname = result["hostname"]
+                yield result
+
+    def _write_report(self, results):
         cols = ["datetime", "hostname", "action", "path",
                 "time_taken", "total_files", "file_status", "file_count", "file_size"
                 ]
         if self.out_file is not None:
-            with open(self.out_file, "w+", encoding="utf-8", newline="") as o:
-                dw = csv.DictWriter(o, fieldnames=cols)
-                dw.writeheader()
-                for item in self.results:
-                    new_row = {k:v for k, v in item.items() if k != "status"}
-                    for status in item["status"]:
-                        new_row["file_status"] = status["file_status"]
-                        new_row["file_count"] = status["file_count"]
-                        new_row["file_size"] = status["file_size"]
-                        dw.writerow(new_row)
+            with open(self.out_file, "w", buffering=1024 * 1024, encoding="utf-8", newline="") as o:
+                dw = csv.writer(o)
+                dw.writerow(cols)
+                dw.writerows(report_rows(results))
+        else:
+            # Every summary is still collated without an output file, so that progress is shown and the host name is
+            # known for the e-mail
+            for _ in results:
+                pass
         return self.out_file
 
     def _email_report(self):
-        server = self.results[0]["hostname"]
+        server = self.hostname
         subject = "Collated MPT statistics for {}".format(server)
         message = "Minimum Preservation Tool (MPT): collated reports for host {host}\n\n" \
             "Attached are the collated statistics " \
@@ -152,12 +173,17 @@ class ReportCollator:
         send_email(subject=subject, recipients=self.email_recipients, message=message, attachments=[self.out_file])
 
     def start(self):
-        files_iterable = scan_tree(path=self.base_path, recursive=True, formats="summary.txt")
-        pool = multiprocessing.Pool(processes=self.num_procs)
-        for result in tqdm(pool.imap_unordered(self._parse_file, files_iterable),
-                           desc="MPTReport({}p)/Collating summaries".format(self.num_procs)):
-            if result is not None:
-                self.results.append(result)
-        self._write_report()
+        # Staging summaries and those from outside the date range are dropped here, by their path alone, rather than
+        # being sent to a worker only to be discarded. The rest are listed up front, which is cheap for a tree of
+        # reports, so that progress can be shown against a total
+        files = list(filter(self._to_collate,
+                            scan_tree(path=self.base_path, recursive=True, formats=["summary.txt"])))
+        # Parsing a summary takes far less time than sending it to a worker, so files are handed out in batches, but
+        # kept small enough for every worker to get a share of a short list
+        chunksize = max(1, min(metadata_chunksize, len(files) // (self.num_procs * 4)))
+        with multiprocessing.Pool(processes=self.num_procs) as pool:
+            results = progress_bar(pool.imap_unordered(self._parse_file, files, chunksize), total=len(files),
+                                   desc="MPTReport({}p)/Collating summaries".format(self.num_procs))
+            self._write_report(self._collect(results))
         if self.email_recipients is not None:
             self._email_report()
@@ -41,6 +41,9 @@ setup(
     install_requires=[
         'tqdm>=4.32',
     ],
+    extras_require={
+        'blake3': ['blake3'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
 
@@ -53,6 +56,6 @@ setup(
 
         # Specify the Python versions you support here. In particular, ensure
         # that you indicate whether you support Python 2, Python 3 or both.
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ]
 )